@@ -0,0 +1,170 @@
+"""
+Part2Project -- cache_lookups.py
+
+Copyright May 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+    Benchmark of the hot cache lookups, with and without the DATABASE_INDEXES.
+
+    It fills the cache tables of a SCRATCH database with generated entries, which
+    removes everything they contained, so it refuses to run on the database of the
+    server configuration.
+
+    Usage: python -m benchmarks.cache_lookups --dbName <scratch database> [--nodes 1000000]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from server.cache.driver import PostgresDriver
+from server.cache.constants import DATABASE_SETUP, DATABASE_INDEXES, SELECTS, TEMPLATES
+from server.config import Config
+
+FILL = [
+    "TRUNCATE jobs, nodes, jobsToNodes RESTART IDENTITY",
+
+    "INSERT INTO nodes (uuid, timemstmp, classifiedBy, validUntil, showLikelihood, hideLikelihood, recommended) "
+        "SELECT 'uuid-' || i, i, 'pnn', now() + interval '1 day', random(), random(), 'SHOW' "
+        "FROM generate_series(1, %(nodes)s) AS i",
+
+    "INSERT INTO jobs (jobID, status, started) "
+        "SELECT 'job-' || i, (ARRAY['WAITING', 'RUNNING', 'DONE', 'STOPPED'])[1 + i %% 4], now() "
+        "FROM generate_series(1, %(jobs)s) AS i",
+
+    "INSERT INTO jobsToNodes (jobID, nodeID) "
+        "SELECT 1 + (i - 1) %% %(jobs)s, i "
+        "FROM generate_series(1, %(nodes)s) AS i"
+]
+
+
+def timed(function,
+          repeat: int) -> float:
+    """
+
+    :param function:    The lookup to time
+    :param repeat:      How many times it is run
+    :return:            The median latency, in milliseconds
+    """
+    times = list()
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return statistics.median(times)
+
+
+def get_lookups(driver: PostgresDriver,
+                nodes: int,
+                jobs: int) -> dict:
+    """
+
+    :param driver:      The driver of the scratch database
+    :param nodes:       The number of nodes in the database
+    :param jobs:        The number of jobs in the database
+    :return:            The lookups to time, by name
+    """
+    rnd = random.Random(0)
+
+    def node():
+        i = rnd.randint(1, nodes)
+        return 'uuid-%d' % i, i
+
+    return {
+        'node-cache-status': lambda: driver.execute_SELECT(SELECTS['node-cache-status'], *node()),
+        'jobID': lambda: driver.execute_SELECT(SELECTS['jobID'], 'job-%d' % rnd.randint(1, jobs)),
+        'jobs-by-status': lambda: driver.execute_SELECT(SELECTS['jobs-by-status'], 'RUNNING'),
+        'nodes-for-job-page': lambda: driver.execute_SELECT(
+            SELECTS['nodes-for-job-page'], 'job-%d' % rnd.randint(1, jobs), 0, 100
+        ),
+        'cached-nodes-results (1000 nodes)': lambda: driver.execute_VALUES(
+            SELECTS['cached-nodes-results'], [node() for _ in range(1000)], TEMPLATES['node'], fetch=True
+        )
+    }
+
+
+def run(driver: PostgresDriver,
+        nodes: int,
+        jobs: int,
+        repeat: int):
+    """
+
+    :param driver:      The driver of the scratch database
+    :param nodes:       The number of nodes to generate
+    :param jobs:        The number of jobs to generate. The nodes are spread evenly among them.
+    :param repeat:      How many times every lookup is run
+    :return:            -
+    """
+    for table in DATABASE_SETUP:
+        driver._execute_query(DATABASE_SETUP[table])
+
+    print("Generating %d nodes and %d jobs..." % (nodes, jobs))
+
+    with driver.transaction() as cursor:
+        for statement in FILL:
+            cursor.execute(statement, {'nodes': nodes, 'jobs': jobs})
+
+    lookups = get_lookups(driver, nodes, jobs)
+    results = dict()
+
+    for indexed in [False, True]:
+        for index in DATABASE_INDEXES:
+            driver._execute_query("DROP INDEX IF EXISTS %s" % index)
+
+        if indexed:
+            driver.create_indexes()
+
+        driver._execute_query("ANALYZE")
+
+        for name, lookup in lookups.items():
+            results[(name, indexed, )] = timed(lookup, repeat)
+
+    print("%-35s %15s %15s" % ('lookup (median)', 'no index (ms)', 'indexed (ms)'))
+
+    for name in lookups:
+        print("%-35s %15.3f %15.3f" % (name, results[(name, False, )], results[(name, True, )]))
+
+
+if __name__ == '__main__':
+    connData = Config.CACHE_CONN_DATA
+
+    parser = argparse.ArgumentParser(description='Benchmark of the cache lookups')
+    parser.add_argument('--dbName', required=True, help='The scratch database. Its cache tables are emptied.')
+    parser.add_argument('--host', default=connData['host'])
+    parser.add_argument('--port', type=int, default=connData['port'])
+    parser.add_argument('--user', default=connData['user'])
+    parser.add_argument('--password', default=connData['password'])
+    parser.add_argument('--nodes', type=int, default=1000000)
+    parser.add_argument('--jobs', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+
+    args = parser.parse_args()
+
+    if args.dbName == connData['dbName']:
+        parser.error("%s is the cache database of the server. Use a scratch database." % args.dbName)
+
+    driver = PostgresDriver(
+        host=args.host,
+        port=args.port,
+        dbName=args.dbName,
+        user=args.user,
+        password=args.password
+    )
+
+    try:
+        run(driver, args.nodes, args.jobs, args.repeat)
+    finally:
+        driver.close()
@@ -0,0 +1,104 @@
+"""
+Part2Project -- feature_matrix.py
+
+Copyright May 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+    Benchmark of build_feature_matrix against the previous way of building
+    the feature matrix, i.e. concatenating a one-row DataFrame per node.
+
+    Usage: python -m benchmarks.feature_matrix [--sizes 1000 5000 100000] [--repeat 3]
+"""
+import argparse
+import random
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from data.features import build_feature_matrix
+from data.features.constants import FEATURES_ONE_HOT
+
+
+def get_random_nodes(count: int) -> list:
+    """
+
+    :param count:       The number of nodes
+    :return:            Random nodes, in the format returned by the feature extractor,
+                        with a few missing values
+    """
+    rnd = random.Random(0)
+
+    return [
+        {
+            'id': ('uuid-%d' % idx, idx, ),
+            'self': dict(
+                (feature, None if rnd.random() < .05 else float(rnd.randint(0, 1)))
+                for feature in FEATURES_ONE_HOT
+            )
+        }
+        for idx in range(count)
+    ]
+
+
+def build_feature_matrix_by_concat(data: list) -> np.ndarray:
+    """
+            The previous implementation, growing a DataFrame one node at a time
+
+    :param data:        The nodes
+    :return:            The feature matrix
+    """
+    df = pd.DataFrame(columns=FEATURES_ONE_HOT)
+
+    for node in data:
+        new_df = pd.DataFrame(node['self'], index=[0])
+
+        df = pd.concat([df, new_df], axis=0, ignore_index=True)
+
+    return df[FEATURES_ONE_HOT].values.astype(float)
+
+
+def run(sizes: list,
+        repeat: int):
+    """
+
+    :param sizes:       The numbers of nodes to benchmark with
+    :param repeat:      How many times every measurement is repeated. The best one is kept.
+    :return:            -
+    """
+    print("%10s %15s %15s %15s" % ('nodes', 'concat (s)', 'float64 (s)', 'float32 (s)'))
+
+    for size in sizes:
+        data = get_random_nodes(size)
+
+        times = [
+            min(timeit.repeat(lambda: build(data), number=1, repeat=repeat))
+            for build in [
+                build_feature_matrix_by_concat,
+                lambda d: build_feature_matrix(d),
+                lambda d: build_feature_matrix(d, dtype=np.float32)
+            ]
+        ]
+
+        print("%10d %15.4f %15.4f %15.4f" % tuple([size] + times))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the feature matrix construction')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 100000])
+    parser.add_argument('--repeat', type=int, default=3)
+
+    args = parser.parse_args()
+
+    run(args.sizes, args.repeat)
@@ -0,0 +1,134 @@
+"""
+Part2Project -- pnn_kernel.py
+
+Copyright May 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+    Benchmark of the PNN Parzen estimates of a trained checkpoint: the previous
+    element-by-element loop, the vectorised exact kernel and the KD-tree indexed
+    kernel, in rows per second.
+
+    The rows are a fixed sample of the stored feature vectors of the checkpoint,
+    so that every run evaluates the same, realistic inputs.
+
+    Usage: python -m benchmarks.pnn_kernel [--checkpoint models/checkpoints/pnn] [--rows 1000] [--loop-rows 10]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from models.config import ModelConfig
+from models.pnn import ProbabilisticNeuralNetwork
+
+
+class ExactConfig(ModelConfig):
+    PNN_INDEX = None
+
+
+class IndexedConfig(ModelConfig):
+    PNN_INDEX = 'kdtree'
+
+
+def get_parzen_estimates_by_loop(model: ProbabilisticNeuralNetwork,
+                                 data: np.ndarray) -> np.ndarray:
+    """
+            The previous implementation, evaluating the kernel one input,
+            one stored vector and one feature at a time
+
+    :param model:       The model holding the stored vectors
+    :param data:        The input vectors
+    :return:            The Parzen estimates
+    """
+    results = np.empty(shape=(len(data), 2), dtype=float)
+
+    for i in range(len(data)):
+        X = data[i, :]
+        g_SHOW = 0.0
+        g_HIDE = 0.0
+
+        for j in range(len(model.weights)):
+            z = - np.sum([((X[k] - model.weights[j, k]) ** 2) * 0.5 for k in range(len(X))])
+            exp = 1/(np.sqrt(2*np.pi)) * np.exp(z)
+            g_SHOW += model.As[j, 0] * exp
+            g_HIDE += model.As[j, 1] * exp
+
+        results[i, :] = np.array([g_SHOW, g_HIDE])
+
+    return results
+
+
+def get_model(config,
+              checkpoint: str) -> ProbabilisticNeuralNetwork:
+    """
+
+    :param config:      The configuration of the model
+    :param checkpoint:  The path to the checkpoint of the model
+    :return:            The PNN, loaded from the checkpoint
+    """
+    model = ProbabilisticNeuralNetwork(config)
+    model.load_checkpoint(path=checkpoint)
+
+    return model
+
+
+def rows_per_second(function,
+                    data: np.ndarray) -> float:
+    """
+
+    :param function:    The Parzen estimates function to time
+    :param data:        The input rows
+    :return:            The number of rows evaluated per second
+    """
+    start = time.perf_counter()
+    function(data)
+
+    return len(data) / (time.perf_counter() - start)
+
+
+def run(checkpoint: str,
+        rows: int,
+        loopRows: int):
+    """
+
+    :param checkpoint:      The path to the checkpoint of the PNN
+    :param rows:            The number of input rows for the vectorised kernels
+    :param loopRows:        The number of input rows for the previous loop, which is much
+                            slower. They are the first loopRows of the same rows.
+    :return:                -
+    """
+    exact = get_model(ExactConfig, checkpoint)
+    indexed = get_model(IndexedConfig, checkpoint)
+
+    rnd = np.random.RandomState(0)
+    data = np.asarray(exact.weights, dtype=float)[rnd.randint(len(exact.weights), size=rows)]
+
+    print("%d stored vectors, %d rows (%d for the loop)" % (len(exact.weights), rows, min(loopRows, rows)))
+    print("%-25s %15s" % ('kernel', 'rows/s'))
+    print("%-25s %15.1f" % ('element-by-element loop', rows_per_second(
+        lambda d: get_parzen_estimates_by_loop(exact, d), data[:loopRows]
+    )))
+    print("%-25s %15.1f" % ('vectorised exact', rows_per_second(exact._get_parzen_estimates, data)))
+    print("%-25s %15.1f" % ('KD-tree indexed', rows_per_second(indexed._get_parzen_estimates, data)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the PNN kernel evaluation')
+    parser.add_argument('--checkpoint', default=ModelConfig.CHECKPOINTS_PATH + 'pnn')
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--loop-rows', type=int, default=10)
+
+    args = parser.parse_args()
+
+    run(args.checkpoint, args.rows, args.loop_rows)
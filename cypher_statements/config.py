@@ -29,3 +29,6 @@ RULES_TO_RUN = [
     'cypher_statements/rules/rule10.cyp',
     'cypher_statements/rules/rule14.cyp'
 ]
+
+# Maximum number of rules executed concurrently
+RULE_WORKERS = 4
@@ -18,34 +18,26 @@ limitations under the License.
 """
 from data.neo4J.database_driver import AnotherDatabaseDriver
 from data.features.feature_extractor import FeatureExtractor
-from data.features.constants import SUPPORTED_FILE_FORMATS, FEATURES_ONE_HOT, LABELS, ACCEPTED_NODE_TYPES
-from cypher_statements.config import RULES_TO_RUN
+from data.features.memo import ExtractionMemo
+from data.features.queries import QUERIES
+from data.features.constants import SUPPORTED_FILE_FORMATS, FEATURES_ONE_HOT, LABELS, ACCEPTED_NODE_TYPES, \
+    EXTRACTION_BATCH_SIZE
+from cypher_statements.config import RULES_TO_RUN, RULE_WORKERS
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
+import numpy as np
 import pickle
+from operator import itemgetter
 
 from data.utils import dump_json, shuffle_list, intersect_two_lists
 
 
-def search_in_list(id: tuple,
-                   nodes: list) -> list:
-    """
-
-    :param id:              (uuid, timestamp, ) tuple representing the ID of the node we're looking for
-    :param nodes:           The list of nodes to search in
-    :return:                The list of indexes where this node has to be found
-    """
-    result = list()
-    for idx in range(len(nodes)):
-        if id == nodes[idx]['id']:
-            result.append(idx)
-    return result
-
-
 def get_dataset(driver: AnotherDatabaseDriver,
                 nodes: list,
                 shuffle: bool = False,
                 for_gat: bool = False,
-                include_NONE: bool=True):
+                include_NONE: bool=True,
+                memo: ExtractionMemo=None):
     """
 
     :param driver:              The neo4j database driver used in this case
@@ -56,16 +48,23 @@ def get_dataset(driver: AnotherDatabaseDriver,
                                 Default False.
     :param include_NONE:        Whether we include the invalid node entries as None or not.
                                 Default True.
+    :param memo:                If provided, the memo of the extraction sub-queries, e.g. shared
+                                by the calls for all the batches of a job. Default None, i.e. a
+                                new one for every extraction run.
 
     :return:                    A dictionary containing the feature vectors extracted
     """
 
     feature_extractor = FeatureExtractor(
         nodes=nodes,
-        driver=driver
+        driver=driver,
+        memo=memo
     )
 
-    features = feature_extractor.get_feature_matrix(include_NONE=include_NONE)
+    features = feature_extractor.get_feature_matrix(
+        include_NONE=include_NONE,
+        batch_size=EXTRACTION_BATCH_SIZE
+    )
 
     if not for_gat:
         if not shuffle:
@@ -74,44 +73,61 @@ def get_dataset(driver: AnotherDatabaseDriver,
             features = shuffle_list(features)
             return features
 
-    neighs = feature_extractor.get_neighbours()
+    neighs = dict(
+        (entry['id'], [(neigh['uuid'], neigh['timestamp'], ) for neigh in entry['neighs']], )
+        for entry in feature_extractor.get_neighbours(batch_size=EXTRACTION_BATCH_SIZE)
+    )
+
+    # Feature vectors indexed by (uuid, timestamp, )
+    extracted = dict((node['id'], node['self'], ) for node in features if node['self'] is not None)
+
+    # All the neighbours we don't have the features of yet, extracted at once
+    to_extract = list(dict.fromkeys(
+        neigh for node in features if node['id'] in neighs
+        for neigh in neighs[node['id']] if neigh not in extracted
+    ))
 
-    extracted = features
+    if len(to_extract) != 0:
+        fe = FeatureExtractor(
+            nodes=[{'uuid': neigh[0], 'timestamp': neigh[1]} for neigh in to_extract],
+            driver=driver,
+            verbose=True,
+            memo=memo
+        )
+
+        for neigh in fe.get_feature_matrix(include_NONE=False, batch_size=EXTRACTION_BATCH_SIZE):
+            extracted[neigh['id']] = neigh['self']
+
+    # The neighbours already known when a node is reached, as when they were
+    # extracted node by node: the input nodes and the neighbours of the previous
+    # nodes. A known neighbour appears once for every edge leading to it, while
+    # a newly extracted one appears once.
+    known = set(node['id'] for node in features if node['self'] is not None)
 
     for node in features:
-        neighs_idx = search_in_list(node['id'], neighs)
-        if len(neighs_idx) == 0:
+        if node['id'] not in neighs:
             node['neighs'] = node['self']
-        else:
-            to_extract = list()
-            node['neighs'] = list()
-            for idx in neighs_idx:
-                for neigh in neighs[idx]['neighs']:
-                    tp = (neigh['uuid'], neigh['timestamp'], )
-                    extracted_idx = search_in_list(tp, extracted)
-                    if len(extracted_idx) != 0 and extracted[extracted_idx[0]]['self'] is not None:
-                        node['neighs'].append(extracted[extracted_idx[0]]['self'])
-                    elif neigh not in to_extract:
-                        to_extract.append(neigh)
+            continue
 
-            if len(to_extract) == 0:
-                continue
+        node['neighs'] = list()
+        new = list()
 
-            fe = FeatureExtractor(
-                nodes=to_extract,
-                driver=driver,
-                verbose=True
-            )
+        for neigh in neighs[node['id']]:
+            if neigh in known:
+                node['neighs'].append(extracted[neigh])
+            elif neigh not in new:
+                new.append(neigh)
 
-            new_nodes = fe.get_feature_matrix(include_NONE=False)
+        new_neighs = [extracted[neigh] for neigh in new if neigh in extracted]
 
-            if len(new_nodes) == 0:
-                new_nodes.append(node)
+        # A node whose new neighbours all failed to be
+        # extracted stands as its own neighbour
+        if len(new_neighs) == 0 and len(new) != 0:
+            new_neighs.append(node['self'])
 
-            for neigh in new_nodes:
-                node['neighs'].append(neigh['self'])
+        known.update(neigh for neigh in new if neigh in extracted)
 
-            extracted = extracted + new_nodes
+        node['neighs'] += new_neighs
 
     if not shuffle:
         return features
@@ -120,6 +136,25 @@ def get_dataset(driver: AnotherDatabaseDriver,
         return features
 
 
+def run_rule(driver: AnotherDatabaseDriver,
+             rule_file: str) -> list:
+    """
+            Function that runs a rule, usually on a thread of the rules pool.
+            The session the driver opened for the thread is closed at the end.
+
+    :param driver:          The driver of the Neo4J database
+    :param rule_file:       Path to the .cyp file of the rule
+    :return:                The nodes returned by the rule
+    """
+    with open(rule_file) as f:
+        rule_query = f.read()
+
+    try:
+        return driver.execute_query(rule_query)
+    finally:
+        driver.close_session()
+
+
 def build_training_set(host: str,
                        port: int,
                        user: str,
@@ -129,7 +164,8 @@ def build_training_set(host: str,
                        save_in_format: str = 'df',
                        save_in_dir: str = 'data/datasets/',
                        filename: str = None,
-                       limit_per_rule: int=1000):
+                       limit_per_rule: int=1000,
+                       rule_workers: int=RULE_WORKERS):
     """
 
             Method that builds a training set based on a set
@@ -154,6 +190,8 @@ def build_training_set(host: str,
                                     Default None.
     :param limit_per_rule:          Up to how many nodes to return for every rule
                                     Default 1000.
+    :param rule_workers:            Maximum number of rules executed concurrently.
+                                    Default RULE_WORKERS.
 
     :return:                        The dataset, as a dictionary. - if successful
                                     None                          - otherwise
@@ -181,51 +219,51 @@ def build_training_set(host: str,
 
     print("Connected to the database!")
 
-    query = "match (x)" \
-            "where not 'Machine' in labels(x) and not 'Pipe' in labels(x) and not 'Meta' in labels(x) and labels(x) <> ['Global']" \
-            "return x.uuid as uuid, x.timestamp as timestamp"
-
     full_results = list()
 
-    all_nodes = driver.execute_query(query)
-    nodes_cnt = len(all_nodes)
-
-    show_nodes = list()
-
-    print("%d nodes to process. Getting to work!" % nodes_cnt)
-
-    for rule_file in RULES_TO_RUN:
-        print("Running rule from %s..." % rule_file)
-        with open(rule_file) as f:
-            rule_query = f.read()
-            result = driver.execute_query(rule_query)
-            print("Executed query. %d to process" % len(result))
+    # The rules are independent read-only queries, so they run concurrently,
+    # at most rule_workers at a time.
+    # The driver gives every thread its own session.
+    with ThreadPoolExecutor(max_workers=max(1, min(rule_workers, len(RULES_TO_RUN)))) as executor:
+        rule_results = executor.map(
+            lambda rule_file: run_rule(driver, rule_file),
+            RULES_TO_RUN
+        )
+
+        # (uuid, timestamp, ) IDs of the nodes labelled SHOW by any of the rules.
+        # A node is only labelled by the first rule returning it,
+        # in the order of RULES_TO_RUN.
+        show_ids = set()
+        show_nodes = list()
+
+        for rule_file, result in zip(RULES_TO_RUN, rule_results):
+            print("Executed rule from %s. %d to process" % (rule_file, len(result)))
+
+            new_nodes = list()
             for node in result:
-                try:
-                    all_nodes.pop(all_nodes.index(node))
-                except ValueError:
-                    # It is not in the list, so we don't add it again :D
-                    result.pop(result.index(node))
+                node_id = (node['uuid'], node['timestamp'], )
 
-            result = result[:min(len(result), limit_per_rule)]
+                if node_id not in show_ids:
+                    show_ids.add(node_id)
+                    new_nodes.append(node)
 
-            features = get_dataset(
-                driver=driver,
-                nodes=result,
-                for_gat=for_gat,
-                include_NONE=False,
-                shuffle=False
-            )
+            show_nodes += new_nodes[:min(len(new_nodes), limit_per_rule)]
 
-            show_nodes = show_nodes + result
+    print("Extracting the features of %d SHOW labeled nodes..." % len(show_nodes))
 
-            for node in features:
-                node['SHOW'] = 1
-                node['HIDE'] = 0
+    features = get_dataset(
+        driver=driver,
+        nodes=show_nodes,
+        for_gat=for_gat,
+        include_NONE=False,
+        shuffle=False
+    )
 
-            print("     Added " + str(len(features)) + " new entries!")
+    for node in features:
+        node['SHOW'] = 1
+        node['HIDE'] = 0
 
-            full_results += features
+    full_results += features
 
     # Setting the HIDE nodes limit so that the training set
     # roughly follows the 30-70 distribution of SHOW/HIDE nodes
@@ -234,7 +272,25 @@ def build_training_set(host: str,
 
     print("Finished adding all SHOW labeled nodes. Added %d in total.\n" % len(full_results))
 
-    hide_nodes = all_nodes[:min(len(all_nodes), limit_for_hide)]
+    # Streaming the nodes of the graph, rather than loading all of them, and
+    # stopping as soon as there are enough HIDE nodes. The query itself stops
+    # after that many nodes plus all the SHOW ones, which might be among them,
+    # as the driver would otherwise still receive the rest of the result.
+    hide_nodes = list()
+    all_nodes = driver.stream_query(
+        QUERIES['all-nodes-limit'],
+        {'limit': limit_for_hide + len(show_ids)}
+    )
+
+    try:
+        for node in all_nodes:
+            if len(hide_nodes) >= limit_for_hide:
+                break
+
+            if (node['uuid'], node['timestamp'], ) not in show_ids:
+                hide_nodes.append(node)
+    finally:
+        all_nodes.close()
 
     print("Moving on to HIDE labeled nodes. %d to add." % len(hide_nodes))
 
@@ -272,37 +328,43 @@ def build_training_set(host: str,
     return full_results
 
 
-def build_df_from_list(data: list):
+def build_feature_matrix(data: list,
+                         dtype=np.float64) -> np.ndarray:
     """
+            Function that builds the feature matrix of a list of nodes,
+            filling a preallocated array one row at a time
 
-    :param data:        Dictionary we're building the DataFrame from
-    :return:            The resulting dataframe
+    :param data:        The nodes, as a list of {'id', 'self'} entries with a feature vector
+    :param dtype:       The type of the values. Default np.float64, i.e. no precision is lost.
+    :return:            The feature matrix, as an array of shape (len(data), len(FEATURES_ONE_HOT)),
+                        with the columns in FEATURES_ONE_HOT order. Missing values are NaN.
     """
-    df = pd.DataFrame(columns=FEATURES_ONE_HOT + ['SHOW', 'HIDE'])
+    get_features = itemgetter(*FEATURES_ONE_HOT)
 
-    for node in data:
-        new_entry = node['self']
-        new_entry['SHOW'] = node['SHOW']
-        new_entry['HIDE'] = node['HIDE']
+    matrix = np.empty((len(data), len(FEATURES_ONE_HOT)), dtype=dtype)
 
-        new_df = pd.DataFrame(new_entry, index=[0])
+    for idx, node in enumerate(data):
+        matrix[idx] = get_features(node['self'])
 
-        df = pd.concat([df, new_df], axis=0, ignore_index=True)
+    return matrix
 
-    return df
 
-def get_df_from_list(data: list):
-    df = pd.DataFrame(columns=FEATURES_ONE_HOT)
-
-    for node in data:
-        new_entry = node['self']
+def build_df_from_list(data: list):
+    """
 
-        new_df = pd.DataFrame(new_entry, index=[0])
+    :param data:        Dictionary we're building the DataFrame from
+    :return:            The resulting dataframe
+    """
+    df = pd.DataFrame(build_feature_matrix(data), columns=FEATURES_ONE_HOT)
 
-        df = pd.concat([df, new_df], axis=0, ignore_index=True)
+    for label in LABELS:
+        df[label] = np.fromiter((node[label] for node in data), dtype=np.int64, count=len(data))
 
     return df
 
+def get_df_from_list(data: list):
+    return pd.DataFrame(build_feature_matrix(data), columns=FEATURES_ONE_HOT)
+
 def save_as_binary(data: pd.DataFrame,
                    path: str) -> None:
     """
@@ -338,15 +400,15 @@ def get_node_type(driver: AnotherDatabaseDriver,
     :return:                The node type, as a string
     """
 
-    query = "match(n {uuid: '%s', timestamp: %d}) " \
-            "return labels(n) limit 1" % (uuid, timestamp)
-
-    labels = driver.execute_query(query)
+    labels = driver.execute_query(
+        QUERIES['accepted-node-type'],
+        {'uuid': uuid, 'timestamp': timestamp}
+    )
 
     if len(labels) == 0:
         return 'N/A'
 
-    labels = labels[0]['labels(n)']
+    labels = labels[0]['labels']
 
     intersect = intersect_two_lists(l1=labels, l2=ACCEPTED_NODE_TYPES)
 
@@ -367,11 +429,10 @@ def get_closest_process(driver: AnotherDatabaseDriver,
     :param timestamp:           The timestamp of the node in question
     :return:                    A dictionary representing the uuid and timestamp of the Process
     """
-    query = "match(n {uuid: '%s', timestamp: %d}) -- (m:Process)" \
-            "return m.uuid as uuid, m.timestamp as timestamp " \
-                "order by abs(n.timestamp - m.timestamp) limit 1" % (uuid, timestamp)
-
-    result = driver.execute_query(query)
+    result = driver.execute_query(
+        QUERIES['closest-connected-process'],
+        {'uuid': uuid, 'timestamp': timestamp}
+    )
 
     if len(result) == 0:
         return dict()
@@ -119,3 +119,11 @@ ACCEPTED_NODE_TYPES = [
     'Pipe',
     'Machine'
 ]
+
+# Number of nodes sent to the database in a single
+# set-at-a-time extraction query
+EXTRACTION_BATCH_SIZE = 5000
+
+# Number of sub-query results memoised during a
+# single feature extraction run
+EXTRACTION_MEMO_SIZE = 100000
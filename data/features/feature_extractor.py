@@ -21,9 +21,62 @@ from data.neo4J.database_driver import AnotherDatabaseDriver
 import pandas as pd
 from strings import LINE_DELIMITER, PROGRESS_REPORT
 from data.features.constants import *
+from data.features.queries import QUERIES, BATCH_QUERIES
+from data.features.memo import ExtractionMemo, memoised
+from contextlib import contextmanager
 import numpy as np
 
 
+def _file_is_suspicious(name) -> float:
+    """
+            Function that checks if a File can be considered suspicious, based on its name
+
+    :param name:            The name property of the File
+
+    :return:                1.0  -  if the File can be considered suspicious
+                            0.0  -  otherwise
+    """
+    if name is None:
+        return 1.0
+
+    name = name[0]
+
+    if any(sub_str in name for sub_str in BLACKLIST['File']):
+        return 1.0
+    return 0.0
+
+
+def _process_is_suspicious(cmd,
+                           files: list) -> float:
+    """
+            Function that checks if a Process can be considered suspicious
+
+    :param cmd:             The cmdline property of the Process
+    :param files:           The Files connected to the Process, as a list of
+                            dictionaries containing their 'name' and the 'state'
+                            of the edge
+
+    :return:                1.0  -  if the Process can be considered suspicious
+                            0.0  -  otherwise
+    """
+    if cmd is None:
+        return 1.0
+
+    if any(sub_str in cmd for sub_str in BLACKLIST['Process']):
+        return 1.0
+
+    # Otherwise, we need to check if it writes to any file in a location that is not safe,
+    # or if the file acting as its binary is on the blacklist
+    for f in files:
+        if f['state'] == 'BIN' and _file_is_suspicious(f['name']) == 1.0:
+            return 1.0
+        if f['state'] != 'READ' and f['name'] is not None:
+            if any(sub_str in f['name'] for sub_str in DANGEROUS_LOCATIONS):
+                return 1.0
+
+    return 0.0
+
+
 class FeatureExtractor(object):
     """
         Class representing a Feature Extractor. Main entry point
@@ -33,7 +86,9 @@ class FeatureExtractor(object):
     def __init__(self,
                  nodes: list,
                  driver: AnotherDatabaseDriver,
-                 verbose: bool = False):
+                 verbose: bool = False,
+                 memo_size: int = EXTRACTION_MEMO_SIZE,
+                 memo: ExtractionMemo = None):
         """
             CONSTRUCTOR
 
@@ -46,6 +101,12 @@ class FeatureExtractor(object):
         :param driver:      The driver
         :param verbose:     Set to 'True' if we want the extractor to give constant feedback and 'False' otherwise.
                             Default True
+        :param memo_size:   How many sub-query results are memoised during a single extraction run,
+                            e.g. for a Process many Files are connected to. 0 or None disables it.
+                            Default EXTRACTION_MEMO_SIZE.
+        :param memo:        If provided, the memo used by every extraction run instead of a new one,
+                            e.g. one shared by the extractors of all the batches of a job. It is kept
+                            at the end of a run, and memo_size is ignored. Default None.
         """
         # Asserting inputs
         for node in nodes:
@@ -55,6 +116,12 @@ class FeatureExtractor(object):
         self._nodes = nodes
         self._dbDriver = driver
         self._verbose = verbose
+        self._memo_size = memo_size
+        self._shared_memo = memo
+
+        # The memo of the current extraction run, and the stats of the last one
+        self._memo = None
+        self.memo_stats = None
 
         if self._verbose:
             print(LINE_DELIMITER)
@@ -62,6 +129,7 @@ class FeatureExtractor(object):
             print("     {:d} nodes to process".format(len(nodes)))
             print(LINE_DELIMITER)
 
+    @memoised
     def _get_node_type(self,
                        uuid: str,
                        timestamp: int):
@@ -74,20 +142,22 @@ class FeatureExtractor(object):
         :return:            The node type, as a string  -  if the uuid and timestamp are valid
                             None                        - otherwise
         """
-        q = "match (n {uuid: '%s', timestamp: %d}) return labels(n)" % (uuid, timestamp)
-
-        results = self._dbDriver.execute_query(q)
+        results = self._dbDriver.execute_query(
+            QUERIES['node-type'],
+            {'uuid': uuid, 'timestamp': timestamp}
+        )
 
         if len(results) == 0:
             return None
 
-        labels = results[0]['labels(n)']
+        labels = results[0]['labels']
 
         for l in labels:
             if l in ACCEPTED_NODES:
                 return l
         return None
 
+    @memoised
     def _get_closest_neighbour(self,
                                uuid: str,
                                timestamp: int,
@@ -115,13 +185,12 @@ class FeatureExtractor(object):
         if type in ['File', 'Socket']:
             # I'm looking for the closest Process to it
 
-            q = "match (f: %s {uuid: '%s', timestamp: %d})-[rel:PROC_OBJ]->(p:Process) " \
-                "return p.uuid as uuid, " \
-                        "p.timestamp as timestamp, " \
-                        "rel.state as rel_sts " \
-                    "order by abs(p.timestamp-f.timestamp) limit 1" % (type, uuid, timestamp)
+            q = QUERIES['closest-process-to-file'] if type == 'File' else QUERIES['closest-process-to-socket']
 
-            results = self._dbDriver.execute_query(q)
+            results = self._dbDriver.execute_query(
+                q,
+                {'uuid': uuid, 'timestamp': timestamp}
+            )
 
             if len(results) == 0:
                 #print("This the reason - File/ Socket")
@@ -140,20 +209,10 @@ class FeatureExtractor(object):
             # or for the closest Socket to the Process. The actual
             # result is going to be the one that is closest to the Process (time-wise)
 
-            q_file = "match (f: File)-[rel:PROC_OBJ]->(p:Process {uuid: '%s', timestamp: %d}) " \
-                        "return f.uuid as uuid, " \
-                        "f.timestamp as timestamp, " \
-                        "rel.state as rel_sts " \
-                    "order by abs(p.timestamp-f.timestamp) limit 1" % (uuid, timestamp)
-
-            q_socket = "match (s: Socket)-[rel:PROC_OBJ]->(p:Process {uuid: '%s', timestamp: %d}) " \
-                            "return s.uuid as uuid, " \
-                            "s.timestamp as timestamp, " \
-                            "rel.state as rel_sts " \
-                        "order by abs(p.timestamp-s.timestamp) limit 1" % (uuid, timestamp)
+            params = {'uuid': uuid, 'timestamp': timestamp}
 
-            closest_file = self._dbDriver.execute_query(q_file)
-            closest_socket = self._dbDriver.execute_query(q_socket)
+            closest_file = self._dbDriver.execute_query(QUERIES['closest-file'], params)
+            closest_socket = self._dbDriver.execute_query(QUERIES['closest-socket'], params)
 
             if len(closest_file) == 0 and len(closest_socket) == 0:
                 #print("This is the reason - Process")
@@ -191,6 +250,7 @@ class FeatureExtractor(object):
                 'dist': min(abs(timestamp - closest_file[0]['timestamp']), abs(timestamp - closest_socket[0]['timestamp']))
             }
 
+    @memoised
     def _process_is_connected(self,
                               uuid: str,
                               timestamp: int):
@@ -204,14 +264,14 @@ class FeatureExtractor(object):
         :return:                1.0 - if the Process is connected
                                 0.0 - otherwise
         """
-        query = 'match (p:Process {uuid: "%s", timestamp: %d})-[:PROC_OBJ]->(s:Socket)' \
-                    ' where not s.name[0]=~"127.0.0.1.*" ' \
-                'return 1' % (uuid, timestamp)
-
-        results = self._dbDriver.execute_query(query)
+        results = self._dbDriver.execute_query(
+            QUERIES['process-is-connected'],
+            {'uuid': uuid, 'timestamp': timestamp}
+        )
 
         return 1.0 if len(results) > 0 else 0.0
 
+    @memoised
     def _file_is_downloaded(self,
                             uuid: str,
                             timestamp: int):
@@ -226,17 +286,14 @@ class FeatureExtractor(object):
         :return:                1.0 - if the File was downloaded
                                 0.0 - otherwise
         """
-        query = 'match (f:File {uuid: "%s"})-[fp:PROC_OBJ]->(p:Process)<-[sp:PROC_OBJ]-(s:Socket)' \
-                    'where f.timestamp <= %d and ' \
-                           '(fp.state="WRITE" or fp.state="RaW" or fp.state="NONE") and ' \
-                           '(sp.state="CLIENT" or fp.state="RaW") and ' \
-                           'not s.name[0]=~"127.0.0.1.*"' \
-                'return f.uuid' % (uuid, timestamp)
-
-        results = self._dbDriver.execute_query(query)
+        results = self._dbDriver.execute_query(
+            QUERIES['file-is-downloaded'],
+            {'uuid': uuid, 'timestamp': timestamp}
+        )
 
         return 1.0 if len(results) != 0 else 0.0
 
+    @memoised
     def _socket_is_connected(self,
                              uuid: str,
                              timestamp: int):
@@ -249,14 +306,14 @@ class FeatureExtractor(object):
         :return:                1.0 if it connects to an external machine
                                 0.0 otherwise
         """
-        q = 'match (s:Socket {uuid: "%s", timestamp: %d}) ' \
-                'where not s.name[0]=~"127.0.0.1.*"' \
-            'return 1' % (uuid, timestamp)
-
-        results = self._dbDriver.execute_query(q)
+        results = self._dbDriver.execute_query(
+            QUERIES['socket-is-connected'],
+            {'uuid': uuid, 'timestamp': timestamp}
+        )
 
         return 1.0 if len(results) != 0 else 0.0
 
+    @memoised
     def _process_uid_gid_sts(self,
                              uuid: str,
                              timestamp: int):
@@ -272,15 +329,15 @@ class FeatureExtractor(object):
                                 GID_STS:   1 if gid == egid
                                            0 otherwise
         """
-        query = 'match (p:Process {uuid: "' + uuid +'", timestamp: ' + str(timestamp) + '})' \
-                'return p.meta_uid = p.meta_euid as uid_sts, ' \
-                       'p.meta_gid = p.meta_egid as gid_sts'
-
-        results = self._dbDriver.execute_query(query)
+        results = self._dbDriver.execute_query(
+            QUERIES['process-uid-gid-sts'],
+            {'uuid': uuid, 'timestamp': timestamp}
+        )
 
         return 1.0 if results[0]['uid_sts'] else 0.0, \
                1.0 if results[0]['gid_sts'] else 0.0
 
+    @memoised
     def _get_version_number(self,
                             uuid: str,
                             timestmap: int):
@@ -291,14 +348,14 @@ class FeatureExtractor(object):
 
         :return:            The version number, as a float
         """
-        query = 'match (x {uuid: "%s"})' \
-                    'where x.timestamp < %d ' \
-                'return x.timestamp order by x.timestamp' % (uuid, timestmap)
-
-        previous_timestamps = self._dbDriver.execute_query(query)
+        previous_timestamps = self._dbDriver.execute_query(
+            QUERIES['previous-versions'],
+            {'uuid': uuid, 'timestamp': timestmap}
+        )
 
         return float(len(previous_timestamps))
 
+    @memoised
     def _is_suspicious(self,
                        uuid: str,
                        timestamp: int,
@@ -312,10 +369,10 @@ class FeatureExtractor(object):
         :return:                1.0  -  if the node can be considered suspicious
                                 0.0  -  otherwise
         """
-        q = "match (n {uuid: '%s', timestamp: %d}) " \
-            "return n.name as name, n.cmdline as cmd" % (uuid, timestamp)
-
-        result = self._dbDriver.execute_query(q)
+        result = self._dbDriver.execute_query(
+            QUERIES['name-and-cmd'],
+            {'uuid': uuid, 'timestamp': timestamp}
+        )
 
         if type == 'File':
             name = result[0]['name']
@@ -342,23 +399,24 @@ class FeatureExtractor(object):
 
             # Otherwise, we need to check if it writes to any file in a location that is not safe,
             # or if the file acting as its binary is on the blacklist
-            query = 'match (p:Process {uuid: "%s", timestamp: %d})<-[rel:PROC_OBJ]-(f:File) ' \
-                    'return rel.state, f.name, f.uuid, f.timestamp' % (uuid, timestamp)
-
-            q_results = self._dbDriver.execute_query(query)
+            q_results = self._dbDriver.execute_query(
+                QUERIES['process-files'],
+                {'uuid': uuid, 'timestamp': timestamp}
+            )
 
             for result in q_results:
-                if result['rel.state'] == 'BIN' and self._is_suspicious(
-                        result['f.uuid'], result['f.timestamp'], 'File') == 1.0:
+                if result['state'] == 'BIN' and self._is_suspicious(
+                        result['uuid'], result['timestamp'], 'File') == 1.0:
                     return 1.0
-                if result['rel.state'] != 'READ':
-                    if any(sub_str in result['f.name'] for sub_str in DANGEROUS_LOCATIONS):
+                if result['state'] != 'READ':
+                    if any(sub_str in result['name'] for sub_str in DANGEROUS_LOCATIONS):
                         return 1.0
 
             # If nothing bad so far, all good. return 0
 
             return 0.0
 
+    @memoised
     def _file_is_external(self,
                           uuid: str,
                           timestamp: int):
@@ -372,15 +430,14 @@ class FeatureExtractor(object):
         :return:                1 - if external
                                 0 - otherwise
         """
-        query = 'match (f:File {uuid: "%s", timestamp: %d})-' \
-                        '[rel_fp:PROC_OBJ]->(p:Process)<-[rel_sp:PROC_OBJ]-(s:Socket) ' \
-                    'where rel_fp.state <> "BIN" ' \
-                'return f.uuid' % (uuid, timestamp)
-
-        results = self._dbDriver.execute_query(query)
+        results = self._dbDriver.execute_query(
+            QUERIES['file-is-external'],
+            {'uuid': uuid, 'timestamp': timestamp}
+        )
 
         return 1.0 if len(results) != 0 else 0.0
 
+    @memoised
     def _get_neighbours_for_node(self,
                                  uuid: str,
                                  timestamp: int):
@@ -392,15 +449,14 @@ class FeatureExtractor(object):
         :return:                A list of all the neighbours of the node,
                                 represented as (uuid, timestamp) pairs
         """
-        query = 'match (n {uuid: "%s", timestamp: %d}) -- (m)' \
-                    'where ("File" in labels(m) or "Process" in labels(m) or "Socket" in labels(m))' \
-                        'and (m.uuid <> "%s" or m.timestamp <> %d)' \
-                'return m.uuid as uuid, m.timestamp as timestamp' % (uuid, timestamp, uuid, timestamp)
-
-        neighs = self._dbDriver.execute_query(query)
+        neighs = self._dbDriver.execute_query(
+            QUERIES['neighbours'],
+            {'uuid': uuid, 'timestamp': timestamp}
+        )
 
         return neighs
 
+    @memoised
     def _get_node_degree(self,
                          uuid: str,
                          timestamp: int):
@@ -413,27 +469,401 @@ class FeatureExtractor(object):
         :return:                The resulting degree
         """
 
-        q = "match (n) " \
-                "with n, size((n)--()) as degree " \
-            "where n.uuid = '%s' and n.timestamp = %d " \
-            "return degree" % (uuid, timestamp)
-
-        result = self._dbDriver.execute_query(q)
+        result = self._dbDriver.execute_query(
+            QUERIES['node-degree'],
+            {'uuid': uuid, 'timestamp': timestamp}
+        )
 
         if len(result) == 0:
             return None
 
         return result[0]['degree']
 
+
+    def _run_batch_query(self,
+                         query: str,
+                         nodes: list) -> list:
+        """
+                Private method that runs one of the set-at-a-time queries
+                for a list of nodes
+
+        :param query:           The query to run. Has to expect a $nodes parameter
+        :param nodes:           The nodes to run the query for, as dictionaries
+                                containing (at least) 'uuid' and 'timestamp'
+
+        :return:                The resulting records, as a list of dictionaries
+        """
+        if len(nodes) == 0:
+            return list()
+
+        return self._dbDriver.execute_query(query, {'nodes': nodes})
+
+    def _get_rows_batch(self,
+                        query: str,
+                        nodes: list) -> dict:
+        """
+                Private method that runs a set-at-a-time query and indexes its
+                results by the (uuid, timestamp, ) of the input node they belong to.
+                If a node has multiple result rows, only the first one is kept.
+
+        :param query:           The query to run
+        :param nodes:           The nodes to run the query for
+
+        :return:                A dictionary (uuid, timestamp, ) -> result row
+        """
+        rows = dict()
+
+        for row in self._run_batch_query(query, nodes):
+            id = (row['uuid'], row['timestamp'], )
+            if id not in rows:
+                rows[id] = row
+
+        return rows
+
+    def _get_ids_batch(self,
+                       query: str,
+                       nodes: list) -> set:
+        """
+                Private method that runs a set-at-a-time existence query
+
+        :param query:           The query to run
+        :param nodes:           The nodes to run the query for
+
+        :return:                The set of (uuid, timestamp, ) pairs the query matched
+        """
+        return set(
+            (row['uuid'], row['timestamp'], ) for row in self._run_batch_query(query, nodes)
+        )
+
+    def _memoised_batch(self,
+                        name: str,
+                        ids: list,
+                        fetch) -> dict:
+        """
+                Private method that runs a set-at-a-time lookup only for the nodes
+                whose result isn't memoised in the current extraction run yet
+
+        :param name:            The name the results are memoised under
+        :param ids:             The (uuid, timestamp, ) pairs of the nodes to look up
+        :param fetch:           Function running the lookup for a list of (uuid, timestamp, )
+                                pairs and returning a dictionary (uuid, timestamp, ) -> result
+                                for the ones it found
+
+        :return:                A dictionary (uuid, timestamp, ) -> result, for the nodes found
+        """
+        if self._memo is None:
+            return fetch(ids)
+
+        results = dict()
+        missing = list()
+
+        for id in ids:
+            result = self._memo.get((name, ) + id)
+
+            if result is ExtractionMemo.MISSING:
+                missing.append(id)
+            elif result is not None:
+                results[id] = result
+
+        fetched = fetch(missing) if len(missing) != 0 else dict()
+
+        for id in missing:
+            # The nodes that weren't found are memoised as None
+            result = fetched.get(id)
+            self._memo.put((name, ) + id, result)
+
+            if result is not None:
+                results[id] = result
+
+        return results
+
+    def _get_process_files_batch(self,
+                                 nodes: list) -> dict:
+        """
+                Private method that returns, for a list of Processes,
+                all the Files connected to them
+
+        :param nodes:           The Processes we're interested in
+
+        :return:                A dictionary (uuid, timestamp, ) -> list of {'state', 'name'}
+        """
+        files = dict()
+
+        for row in self._run_batch_query(BATCH_QUERIES['process-files'], nodes):
+            id = (row['uuid'], row['timestamp'], )
+            files.setdefault(id, list()).append(row)
+
+        return files
+
+    def _extract_batch(self,
+                       nodes: list,
+                       include_NONE: bool) -> list:
+        """
+                Private method that computes the feature vectors for a list of nodes,
+                using a fixed number of set-at-a-time queries rather than a number of
+                queries proportional to the number of nodes
+
+        :param nodes:           The nodes to get the feature vectors for
+        :param include_NONE:    Whether to include the nodes we failed to get a
+                                feature vector for as 'NONE' or not
+
+        :return:                A list of {'id', 'self'} entries, in the same order as nodes
+        """
+        def as_param(id):
+            return {'uuid': id[0], 'timestamp': id[1]}
+
+        valid = list(dict.fromkeys(
+            (node['uuid'], node['timestamp'], ) for node in nodes
+            if not any(node[x] is None for x in node)
+        ))
+
+        """
+            NODE TYPES and DEGREE
+        """
+        def node_info(ids):
+            return self._memoised_batch(
+                'node-info', ids,
+                lambda ids: self._get_rows_batch(BATCH_QUERIES['node-info'], [as_param(id) for id in ids])
+            )
+
+        def matched(name, ids):
+            return set(self._memoised_batch(
+                name, list(ids),
+                lambda ids: dict.fromkeys(
+                    self._get_ids_batch(BATCH_QUERIES[name], [as_param(id) for id in ids]), True
+                )
+            ))
+
+        info = node_info(valid)
+
+        types = dict()
+        for id in valid:
+            if id not in info:
+                continue
+            for l in info[id]['labels']:
+                if l in ACCEPTED_NODES:
+                    types[id] = l
+                    break
+
+        """
+            CLOSEST NEIGHBOUR
+        """
+        # One query per label, so that the database can look the nodes up by label
+        closest_process = self._get_rows_batch(
+            BATCH_QUERIES['closest-process-file'], [as_param(id) for id in types if types[id] == 'File']
+        )
+        closest_process.update(self._get_rows_batch(
+            BATCH_QUERIES['closest-process-socket'], [as_param(id) for id in types if types[id] == 'Socket']
+        ))
+        processes = [as_param(id) for id in types if types[id] == 'Process']
+        closest_file = self._get_rows_batch(BATCH_QUERIES['closest-file'], processes)
+        closest_socket = self._get_rows_batch(BATCH_QUERIES['closest-socket'], processes)
+
+        def neighbour(type, row, timestamp):
+            return {
+                'type': type,
+                'uuid': row['n_uuid'],
+                'timestamp': row['n_timestamp'],
+                'edge': row['rel_sts'],
+                'dist': abs(timestamp - row['n_timestamp']) if row['n_timestamp'] is not None else None
+            }
+
+        neighs = dict()
+        for id in types:
+            if types[id] in ['File', 'Socket']:
+                if id in closest_process and closest_process[id]['n_uuid'] is not None:
+                    neighs[id] = neighbour('Process', closest_process[id], id[1])
+                continue
+
+            f = closest_file.get(id)
+            s = closest_socket.get(id)
+            f = f if f is not None and f['n_uuid'] is not None else None
+            s = s if s is not None and s['n_uuid'] is not None else None
+
+            if f is None and s is None:
+                continue
+            if f is None:
+                neighs[id] = neighbour('Socket', s, id[1])
+            elif s is None:
+                neighs[id] = neighbour('File', f, id[1])
+            else:
+                neigh_f = neighbour('File', f, id[1])
+                neigh_s = neighbour('Socket', s, id[1])
+                if neigh_f['dist'] is None or neigh_s['dist'] is None:
+                    continue
+                neighs[id] = neigh_f if neigh_s['dist'] > neigh_f['dist'] else neigh_s
+
+        # Dropping the nodes we can't build a feature vector for
+        for id in list(neighs.keys()):
+            neigh = neighs[id]
+            if any(neigh[x] is None for x in neigh) or neigh['type'] not in ACCEPTED_NODES:
+                neighs.pop(id)
+
+        neigh_ids = list(dict.fromkeys(
+            (neighs[id]['uuid'], neighs[id]['timestamp'], ) for id in neighs
+        ))
+        neigh_ids = [id for id in neigh_ids if id not in info]
+
+        info.update(node_info(neigh_ids))
+
+        """
+            WEB_CONN, NEIGH_WEB_CONN, VERSION, SUSPICIOUS and EXTERNAL
+        """
+        by_type = {'File': set(), 'Process': set(), 'Socket': set()}
+        for id in neighs:
+            by_type[types[id]].add(id)
+            by_type[neighs[id]['type']].add((neighs[id]['uuid'], neighs[id]['timestamp'], ))
+
+        process_connected = matched('process-is-connected', by_type['Process'])
+        file_downloaded = matched('file-is-downloaded', by_type['File'])
+        socket_connected = matched('socket-is-connected', by_type['Socket'])
+        file_external = self._get_ids_batch(
+            BATCH_QUERIES['file-is-external'], [as_param(id) for id in neighs if types[id] == 'File']
+        )
+        versions = self._get_rows_batch(
+            BATCH_QUERIES['version-number'], [as_param(id) for id in neighs]
+        )
+        # The Processes we need to check for suspicious Files are the Process
+        # nodes themselves and the closest Processes to the Socket nodes
+        process_files = self._memoised_batch(
+            'process-files',
+            list(dict.fromkeys(
+                id if types[id] == 'Process' else (neighs[id]['uuid'], neighs[id]['timestamp'], )
+                for id in neighs if types[id] in ['Process', 'Socket']
+            )),
+            lambda ids: self._get_process_files_batch([as_param(id) for id in ids])
+        )
+
+        def web_conn(id, type):
+            if type == 'Socket':
+                return 1.0 if id in socket_connected else 0.0
+            if type == 'File':
+                return 1.0 if id in file_downloaded else 0.0
+            return 1.0 if id in process_connected else 0.0
+
+        def suspicious(id, type):
+            node_info = info.get(id, dict())
+            if type == 'File':
+                return _file_is_suspicious(node_info.get('name'))
+            return _process_is_suspicious(node_info.get('cmd'), process_files.get(id, list()))
+
+        """
+            BUILDING THE FEATURE VECTORS
+        """
+        result = list()
+
+        for node in nodes:
+            id = (node['uuid'], node['timestamp'], )
+
+            if id not in neighs:
+                if include_NONE:
+                    result.append({
+                        'id': id,
+                        'self': None
+                    })
+                continue
+
+            node_type = types[id]
+            neigh_data = neighs[id]
+            neigh_id = (neigh_data['uuid'], neigh_data['timestamp'], )
+            node_features = dict()
+
+            for feature in NODE_TYPE_FEATURES:
+                node_features[feature] = 1.0 if NODE_TYPE_FEATURES[feature] == node_type else 0.0
+
+            node_features['DEGREE'] = info[id]['degree']
+
+            for feature in NEIGH_TYPE_FEATURES:
+                node_features[feature] = 1.0 if NEIGH_TYPE_FEATURES[feature] == neigh_data['type'] else 0.0
+
+            for feature in EDGE_TYPE_FEATURES:
+                node_features[feature] = 1.0 if EDGE_TYPE_FEATURES[feature] == neigh_data['edge'] else 0.0
+
+            node_features['NEIGH_DIST'] = np.log(neigh_data['dist']) if neigh_data['dist'] != 0 else 0.0
+            node_features['NEIGH_DEGREE'] = info[neigh_id]['degree'] if neigh_id in info else None
+
+            node_features['WEB_CONN'] = web_conn(id, node_type)
+            node_features['NEIGH_WEB_CONN'] = web_conn(neigh_id, neigh_data['type'])
+
+            uid_gid_source = info.get(id if node_type == 'Process' else neigh_id, dict())
+            node_features['UID_STS'] = 1.0 if uid_gid_source.get('uid_sts') else 0.0
+            node_features['GID_STS'] = 1.0 if uid_gid_source.get('gid_sts') else 0.0
+
+            node_features['VERSION'] = float(versions[id]['version']) if id in versions else 0.0
+
+            if node_type == 'Socket':
+                node_features['SUSPICIOUS'] = suspicious(neigh_id, 'Process')
+            else:
+                node_features['SUSPICIOUS'] = suspicious(id, node_type)
+
+            if node_type in ['Socket', 'Process']:
+                node_features['EXTERNAL'] = node_features['WEB_CONN']
+            else:
+                node_features['EXTERNAL'] = 1.0 if id in file_external else 0.0
+
+            result.append({
+                'id': id,
+                'self': node_features
+            })
+
+        return result
+
+    @contextmanager
+    def _extraction_run(self):
+        """
+                Private context manager opening the memo of an extraction run, which
+                the memoised sub-queries use until the end of the 'with' block. The
+                memo stats of the run are then left in self.memo_stats. They include
+                the previous runs if the memo is shared.
+
+        :return:                -
+        """
+        if self._shared_memo is not None:
+            self._memo = self._shared_memo
+        else:
+            self._memo = ExtractionMemo(self._memo_size) if self._memo_size else None
+
+        try:
+            yield
+        finally:
+            if self._memo is not None:
+                self.memo_stats = self._memo.stats()
+                self._memo = None
+
+                if self._verbose:
+                    print("Memoised sub-queries: %d hits, %d misses" % (
+                        self.memo_stats['hits'], self.memo_stats['misses']
+                    ))
+
     def get_feature_matrix(self,
-                           include_NONE=True):
+                           include_NONE=True,
+                           batch_size: int=None):
         """
 
         :param include_NONE:    Whether we want to include the nodes we failed to get a
                                 feature vector for as 'NONE' or not. Default True
-        :return:                A pandas dict containing all the features
+        :param batch_size:      If provided, the features are extracted set-at-a-time,
+                                for batch_size nodes at once, rather than node by node.
+                                Default None.
+        :return:                A pandas dict containing all the features. The memo stats of
+                                the run are left in self.memo_stats.
+        """
+        with self._extraction_run():
+            if batch_size is not None:
+                return self._get_feature_matrix_batched(include_NONE, batch_size)
+
+            return self._get_feature_matrix_per_node(include_NONE)
+
+    def _get_feature_matrix_per_node(self,
+                                     include_NONE: bool):
         """
+                Private method that builds the feature matrix node by node
 
+        :param include_NONE:    Whether we want to include the nodes we failed to get a
+                                feature vector for as 'NONE' or not
+
+        :return:                Same as get_feature_matrix()
+        """
         result = list()
         cnt_done = 0
 
@@ -628,12 +1058,97 @@ class FeatureExtractor(object):
 
         return result
 
-    def get_neighbours(self):
+    def _get_feature_matrix_batched(self,
+                                    include_NONE: bool,
+                                    batch_size: int):
+        """
+                Private method that builds the feature matrix set-at-a-time,
+                batch_size nodes at once
+
+        :param include_NONE:    Whether we want to include the nodes we failed to get a
+                                feature vector for as 'NONE' or not
+        :param batch_size:      How many nodes to send to the database at once
+
+        :return:                Same as get_feature_matrix()
+        """
+        assert batch_size > 0
+
+        result = list()
+        total = len(self._nodes)
+
+        if self._verbose:
+            print("Building feature matrix, %d nodes at a time..." % batch_size)
+            print(PROGRESS_REPORT[0] % (0, total))
+
+        for start in range(0, total, batch_size):
+            batch = self._nodes[start:start + batch_size]
+            with self._dbDriver.transaction():
+                result += self._extract_batch(batch, include_NONE)
+
+            if self._verbose:
+                cnt_done = min(start + batch_size, total)
+                step = int(float(cnt_done / total) * 100) // PROGRESS_REPORT['step'] * PROGRESS_REPORT['step']
+                print(PROGRESS_REPORT[step / 100] % (cnt_done, total))
+
+        return result
+
+    def _get_neighbours_batched(self,
+                                batch_size: int):
+        """
+                Private method that gets the neighbours set-at-a-time,
+                batch_size nodes at once
+
+        :param batch_size:      How many nodes to send to the database at once
+
+        :return:                Same as get_neighbours()
+        """
+        assert batch_size > 0
+
+        ids = list(dict.fromkeys(
+            (node['uuid'], node['timestamp'], ) for node in self._nodes
+            if not any(node[x] is None for x in node)
+        ))
+
+        if self._verbose:
+            print("Getting neighbourhood data, %d nodes at a time..." % batch_size)
+
+        neighs = dict((id, list(), ) for id in ids)
+
+        for start in range(0, len(ids), batch_size):
+            batch = [{'uuid': id[0], 'timestamp': id[1]} for id in ids[start:start + batch_size]]
+
+            for row in self._run_batch_query(BATCH_QUERIES['neighbours'], batch):
+                neighs[(row['uuid'], row['timestamp'], )].append({
+                    'uuid': row['n_uuid'],
+                    'timestamp': row['n_timestamp']
+                })
+
+        return [{'id': id, 'neighs': neighs[id]} for id in ids]
+
+    def get_neighbours(self,
+                       batch_size: int=None):
         """
             Method that returns a list of the neighbouring nodes for each
             of the nodes provided
 
-        :return:    A list of neighbours for every node.
+        :param batch_size:      If provided, the neighbours are looked up set-at-a-time,
+                                for batch_size nodes at once, and every node is only
+                                returned once. Default None.
+        :return:    A list of neighbours for every node. The memo stats of the run
+                    are left in self.memo_stats.
+        """
+        with self._extraction_run():
+            if batch_size is not None:
+                return self._get_neighbours_batched(batch_size)
+
+            return self._get_neighbours_per_node()
+
+    def _get_neighbours_per_node(self):
+        """
+                Private method that gets the neighbours node by node. The
+                nodes that appear more than once are only looked up once.
+
+        :return:                Same as get_neighbours()
         """
         result = list()
         if self._verbose:
@@ -0,0 +1,74 @@
+"""
+Part2Project -- memo.py
+
+Copyright Mar 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from functools import wraps
+
+from data.lru import LRUCache
+
+
+class ExtractionMemo(LRUCache):
+    """
+        Bounded memo of the results of the feature extraction sub-queries,
+        meant to live for a single extraction run. When full, the least
+        recently used results are dropped first.
+    """
+
+    # Returned by get() for the keys that are not memoised.
+    # None can't be used, as it is a valid result.
+    MISSING = object()
+
+    def get(self,
+            key,
+            default=MISSING):
+        """
+
+        :param key:             The key of the result
+        :param default:         What to return if the key is not memoised.
+                                Default ExtractionMemo.MISSING.
+        :return:                The memoised result - if found
+                                default - otherwise
+        """
+        return super(ExtractionMemo, self).get(key, default)
+
+
+def memoised(method):
+    """
+            Decorator memoising the result of a FeatureExtractor method in the
+            memo of the current extraction run, based on the method name and
+            its arguments. Outside of an extraction run, the method is simply called.
+
+    :param method:          The method to memoise
+    :return:                The memoised method
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        memo = self._memo
+
+        if memo is None:
+            return method(self, *args, **kwargs)
+
+        key = (method.__name__, args, tuple(sorted(kwargs.items())), )
+        result = memo.get(key)
+
+        if result is ExtractionMemo.MISSING:
+            result = method(self, *args, **kwargs)
+            memo.put(key, result)
+
+        return result
+
+    return wrapper
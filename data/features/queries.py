@@ -0,0 +1,218 @@
+"""
+Part2Project -- queries.py
+
+Copyright Mar 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+# Per-node feature extraction queries. The node is always identified by
+# the $uuid and $timestamp parameters, so every query keeps a single, fixed
+# text and its execution plan can be cached by the database.
+QUERIES = {
+    'node-type': 'MATCH (n {uuid: $uuid, timestamp: $timestamp}) '
+                 'RETURN labels(n) AS labels',
+
+    'closest-process-to-file': 'MATCH (f:File {uuid: $uuid, timestamp: $timestamp})-[rel:PROC_OBJ]->(p:Process) '
+                               'RETURN p.uuid AS uuid, '
+                                      'p.timestamp AS timestamp, '
+                                      'rel.state AS rel_sts '
+                               'ORDER BY abs(p.timestamp - f.timestamp) LIMIT 1',
+
+    'closest-process-to-socket': 'MATCH (f:Socket {uuid: $uuid, timestamp: $timestamp})-[rel:PROC_OBJ]->(p:Process) '
+                                 'RETURN p.uuid AS uuid, '
+                                        'p.timestamp AS timestamp, '
+                                        'rel.state AS rel_sts '
+                                 'ORDER BY abs(p.timestamp - f.timestamp) LIMIT 1',
+
+    'closest-file': 'MATCH (f:File)-[rel:PROC_OBJ]->(p:Process {uuid: $uuid, timestamp: $timestamp}) '
+                    'RETURN f.uuid AS uuid, '
+                           'f.timestamp AS timestamp, '
+                           'rel.state AS rel_sts '
+                    'ORDER BY abs(p.timestamp - f.timestamp) LIMIT 1',
+
+    'closest-socket': 'MATCH (s:Socket)-[rel:PROC_OBJ]->(p:Process {uuid: $uuid, timestamp: $timestamp}) '
+                      'RETURN s.uuid AS uuid, '
+                             's.timestamp AS timestamp, '
+                             'rel.state AS rel_sts '
+                      'ORDER BY abs(p.timestamp - s.timestamp) LIMIT 1',
+
+    'process-is-connected': 'MATCH (p:Process {uuid: $uuid, timestamp: $timestamp})-[:PROC_OBJ]->(s:Socket) '
+                            'WHERE NOT s.name[0] =~ "127.0.0.1.*" '
+                            'RETURN 1',
+
+    'file-is-downloaded': 'MATCH (f:File {uuid: $uuid})-[fp:PROC_OBJ]->(p:Process)<-[sp:PROC_OBJ]-(s:Socket) '
+                          'WHERE f.timestamp <= $timestamp AND '
+                                '(fp.state = "WRITE" OR fp.state = "RaW" OR fp.state = "NONE") AND '
+                                '(sp.state = "CLIENT" OR fp.state = "RaW") AND '
+                                'NOT s.name[0] =~ "127.0.0.1.*" '
+                          'RETURN f.uuid',
+
+    'socket-is-connected': 'MATCH (s:Socket {uuid: $uuid, timestamp: $timestamp}) '
+                           'WHERE NOT s.name[0] =~ "127.0.0.1.*" '
+                           'RETURN 1',
+
+    'process-uid-gid-sts': 'MATCH (p:Process {uuid: $uuid, timestamp: $timestamp}) '
+                           'RETURN p.meta_uid = p.meta_euid AS uid_sts, '
+                                  'p.meta_gid = p.meta_egid AS gid_sts',
+
+    'previous-versions': 'MATCH (x {uuid: $uuid}) '
+                         'WHERE x.timestamp < $timestamp '
+                         'RETURN x.timestamp ORDER BY x.timestamp',
+
+    'name-and-cmd': 'MATCH (n {uuid: $uuid, timestamp: $timestamp}) '
+                    'RETURN n.name AS name, n.cmdline AS cmd',
+
+    'process-files': 'MATCH (p:Process {uuid: $uuid, timestamp: $timestamp})<-[rel:PROC_OBJ]-(f:File) '
+                     'RETURN rel.state AS state, f.name AS name, f.uuid AS uuid, f.timestamp AS timestamp',
+
+    'file-is-external': 'MATCH (f:File {uuid: $uuid, timestamp: $timestamp})-'
+                              '[rel_fp:PROC_OBJ]->(p:Process)<-[rel_sp:PROC_OBJ]-(s:Socket) '
+                        'WHERE rel_fp.state <> "BIN" '
+                        'RETURN f.uuid',
+
+    'neighbours': 'MATCH (n {uuid: $uuid, timestamp: $timestamp})--(m) '
+                  'WHERE ("File" IN labels(m) OR "Process" IN labels(m) OR "Socket" IN labels(m)) '
+                        'AND (m.uuid <> $uuid OR m.timestamp <> $timestamp) '
+                  'RETURN m.uuid AS uuid, m.timestamp AS timestamp',
+
+    'node-degree': 'MATCH (n {uuid: $uuid, timestamp: $timestamp}) '
+                   'RETURN size((n)--()) AS degree',
+
+    'accepted-node-type': 'MATCH (n {uuid: $uuid, timestamp: $timestamp}) '
+                          'RETURN labels(n) AS labels LIMIT 1',
+
+    'closest-connected-process': 'MATCH (n {uuid: $uuid, timestamp: $timestamp})--(m:Process) '
+                                 'RETURN m.uuid AS uuid, m.timestamp AS timestamp '
+                                 'ORDER BY abs(n.timestamp - m.timestamp) LIMIT 1',
+
+    'all-nodes': 'MATCH (x) '
+                 'WHERE NOT "Machine" IN labels(x) AND NOT "Pipe" IN labels(x) AND NOT "Meta" IN labels(x) '
+                       'AND labels(x) <> ["Global"] '
+                 'RETURN x.uuid AS uuid, x.timestamp AS timestamp',
+
+    'all-nodes-limit': 'MATCH (x) '
+                       'WHERE NOT "Machine" IN labels(x) AND NOT "Pipe" IN labels(x) AND NOT "Meta" IN labels(x) '
+                             'AND labels(x) <> ["Global"] '
+                       'RETURN x.uuid AS uuid, x.timestamp AS timestamp LIMIT $limit',
+
+    'random-files': 'MATCH (n:File) '
+                    'RETURN n.uuid AS uuid, n.timestamp AS timestamp LIMIT $limit'
+}
+
+# Set-at-a-time versions of the feature extraction queries. Every one of them
+# takes a $nodes parameter - a list of {'uuid': ..., 'timestamp': ...} maps -
+# and returns one row per input node it matched, keyed by the input uuid and
+# timestamp.
+BATCH_QUERIES = {
+    'node-info': 'UNWIND $nodes AS node '
+                 'MATCH (n {uuid: node.uuid, timestamp: node.timestamp}) '
+                 'RETURN node.uuid AS uuid, '
+                        'node.timestamp AS timestamp, '
+                        'labels(n) AS labels, '
+                        'size((n)--()) AS degree, '
+                        'n.name AS name, '
+                        'n.cmdline AS cmd, '
+                        'n.meta_uid = n.meta_euid AS uid_sts, '
+                        'n.meta_gid = n.meta_egid AS gid_sts',
+
+    'closest-process-file': 'UNWIND $nodes AS node '
+                            'MATCH (f:File {uuid: node.uuid, timestamp: node.timestamp})-[rel:PROC_OBJ]->(p:Process) '
+                            'WITH node, p, rel '
+                            'ORDER BY abs(p.timestamp - node.timestamp) '
+                            'WITH node, collect({uuid: p.uuid, timestamp: p.timestamp, rel_sts: rel.state})[0] AS closest '
+                            'RETURN node.uuid AS uuid, '
+                                   'node.timestamp AS timestamp, '
+                                   'closest.uuid AS n_uuid, '
+                                   'closest.timestamp AS n_timestamp, '
+                                   'closest.rel_sts AS rel_sts',
+
+    'closest-process-socket': 'UNWIND $nodes AS node '
+                              'MATCH (s:Socket {uuid: node.uuid, timestamp: node.timestamp})-[rel:PROC_OBJ]->(p:Process) '
+                              'WITH node, p, rel '
+                              'ORDER BY abs(p.timestamp - node.timestamp) '
+                              'WITH node, collect({uuid: p.uuid, timestamp: p.timestamp, rel_sts: rel.state})[0] AS closest '
+                              'RETURN node.uuid AS uuid, '
+                                     'node.timestamp AS timestamp, '
+                                     'closest.uuid AS n_uuid, '
+                                     'closest.timestamp AS n_timestamp, '
+                                     'closest.rel_sts AS rel_sts',
+
+    'closest-file': 'UNWIND $nodes AS node '
+                    'MATCH (f:File)-[rel:PROC_OBJ]->(p:Process {uuid: node.uuid, timestamp: node.timestamp}) '
+                    'WITH node, f, rel '
+                    'ORDER BY abs(f.timestamp - node.timestamp) '
+                    'WITH node, collect({uuid: f.uuid, timestamp: f.timestamp, rel_sts: rel.state})[0] AS closest '
+                    'RETURN node.uuid AS uuid, '
+                           'node.timestamp AS timestamp, '
+                           'closest.uuid AS n_uuid, '
+                           'closest.timestamp AS n_timestamp, '
+                           'closest.rel_sts AS rel_sts',
+
+    'closest-socket': 'UNWIND $nodes AS node '
+                      'MATCH (s:Socket)-[rel:PROC_OBJ]->(p:Process {uuid: node.uuid, timestamp: node.timestamp}) '
+                      'WITH node, s, rel '
+                      'ORDER BY abs(s.timestamp - node.timestamp) '
+                      'WITH node, collect({uuid: s.uuid, timestamp: s.timestamp, rel_sts: rel.state})[0] AS closest '
+                      'RETURN node.uuid AS uuid, '
+                             'node.timestamp AS timestamp, '
+                             'closest.uuid AS n_uuid, '
+                             'closest.timestamp AS n_timestamp, '
+                             'closest.rel_sts AS rel_sts',
+
+    'process-is-connected': 'UNWIND $nodes AS node '
+                            'MATCH (p:Process {uuid: node.uuid, timestamp: node.timestamp})-[:PROC_OBJ]->(s:Socket) '
+                            'WHERE NOT s.name[0] =~ "127.0.0.1.*" '
+                            'RETURN DISTINCT node.uuid AS uuid, node.timestamp AS timestamp',
+
+    'file-is-downloaded': 'UNWIND $nodes AS node '
+                          'MATCH (f:File {uuid: node.uuid})-[fp:PROC_OBJ]->(p:Process)<-[sp:PROC_OBJ]-(s:Socket) '
+                          'WHERE f.timestamp <= node.timestamp AND '
+                                '(fp.state = "WRITE" OR fp.state = "RaW" OR fp.state = "NONE") AND '
+                                '(sp.state = "CLIENT" OR fp.state = "RaW") AND '
+                                'NOT s.name[0] =~ "127.0.0.1.*" '
+                          'RETURN DISTINCT node.uuid AS uuid, node.timestamp AS timestamp',
+
+    'socket-is-connected': 'UNWIND $nodes AS node '
+                           'MATCH (s:Socket {uuid: node.uuid, timestamp: node.timestamp}) '
+                           'WHERE NOT s.name[0] =~ "127.0.0.1.*" '
+                           'RETURN DISTINCT node.uuid AS uuid, node.timestamp AS timestamp',
+
+    'file-is-external': 'UNWIND $nodes AS node '
+                        'MATCH (f:File {uuid: node.uuid, timestamp: node.timestamp})-'
+                              '[rel_fp:PROC_OBJ]->(p:Process)<-[rel_sp:PROC_OBJ]-(s:Socket) '
+                        'WHERE rel_fp.state <> "BIN" '
+                        'RETURN DISTINCT node.uuid AS uuid, node.timestamp AS timestamp',
+
+    'version-number': 'UNWIND $nodes AS node '
+                      'MATCH (x {uuid: node.uuid}) '
+                      'WHERE x.timestamp < node.timestamp '
+                      'RETURN node.uuid AS uuid, node.timestamp AS timestamp, count(x) AS version',
+
+    'process-files': 'UNWIND $nodes AS node '
+                     'MATCH (p:Process {uuid: node.uuid, timestamp: node.timestamp})<-[rel:PROC_OBJ]-(f:File) '
+                     'RETURN node.uuid AS uuid, '
+                            'node.timestamp AS timestamp, '
+                            'rel.state AS state, '
+                            'f.name AS name',
+
+    'neighbours': 'UNWIND $nodes AS node '
+                  'MATCH (n {uuid: node.uuid, timestamp: node.timestamp})--(m) '
+                  'WHERE ("File" IN labels(m) OR "Process" IN labels(m) OR "Socket" IN labels(m)) '
+                        'AND (m.uuid <> node.uuid OR m.timestamp <> node.timestamp) '
+                  'RETURN node.uuid AS uuid, '
+                         'node.timestamp AS timestamp, '
+                         'm.uuid AS n_uuid, '
+                         'm.timestamp AS n_timestamp'
+}
@@ -0,0 +1,159 @@
+"""
+Part2Project -- lru.py
+
+Copyright Apr 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from collections import OrderedDict
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+        Bounded, thread-safe, in-memory cache evicting the least recently
+        used entries first. Every entry can have its own expiry time, after
+        which it is never returned again.
+    """
+    def __init__(self,
+                 maxSize: int):
+        """
+            CONSTRUCTOR
+
+        :param maxSize:         The maximum number of entries kept in memory
+        """
+        assert maxSize > 0
+
+        self.maxSize = maxSize
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self,
+            key,
+            default=None):
+        """
+            Method that returns the value cached for a key and marks it as
+            the most recently used
+
+        :param key:         The key to look for
+        :param default:     What to return if the key is not cached. Default None.
+        :return:            The value - if cached and not expired
+                            default - otherwise
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, expiresAt = entry
+
+            if expiresAt is not None and expiresAt <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+            return value
+
+    def put(self,
+            key,
+            value,
+            ttl: float=None):
+        """
+            Method that caches a value, evicting the least recently used
+            entries if the cache is full
+
+        :param key:         The key of the value
+        :param value:       The value to cache
+        :param ttl:         Number of seconds the value is valid for, e.g. a float or a
+                            Decimal read from the database. Default None, i.e. until
+                            it is evicted.
+        :return:            -
+        """
+        if ttl is not None and ttl <= 0:
+            self.invalidate(key)
+            return
+
+        expiresAt = time.monotonic() + float(ttl) if ttl is not None else None
+
+        with self._lock:
+            self._entries[key] = (value, expiresAt, )
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self,
+                   key):
+        """
+            Method that removes a key from the cache, if it is cached
+
+        :param key:         The key to remove
+        :return:            -
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """
+            Method that removes all the entries from the cache
+
+        :return:            -
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+            Method that returns the usage statistics of the cache
+
+        :return:            A dictionary with the following format:
+                                {
+                                    'size':         number of entries currently cached,
+                                    'maxSize':      maximum number of entries,
+                                    'hits':         number of lookups served from memory,
+                                    'misses':       number of lookups that weren't,
+                                    'hitRate':      hits / (hits + misses), or None if nothing was looked up,
+                                    'evictions':    number of entries evicted to make room for new ones,
+                                    'expirations':  number of expired entries found
+                                }
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return {
+                'size': len(self._entries),
+                'maxSize': self.maxSize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / lookups if lookups > 0 else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+    def __len__(self):
+        return len(self._entries)
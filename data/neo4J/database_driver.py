@@ -18,6 +18,8 @@ limitations under the License.
 """
 from py2neo import Graph, Node
 from neo4j.v1 import GraphDatabase
+from contextlib import contextmanager
+import threading
 
 
 class DatabaseDriver(object):
@@ -93,7 +95,9 @@ class AnotherDatabaseDriver(object):
                  host: str,
                  port: int,
                  user: str,
-                 pswd: str):
+                 pswd: str,
+                 max_pool_size: int=50,
+                 keep_sessions: bool=True):
         """
                 CONSTRUCTOR
 
@@ -102,46 +106,180 @@ class AnotherDatabaseDriver(object):
         :param port:            The TCP port where the Neo4J database is running
         :param user:            Username used to login to the database
         :param pswd:            Password used to loing to the database
+        :param max_pool_size:   Maximum number of connections the driver keeps
+                                open to the database. Default 50.
+        :param keep_sessions:   Whether every thread keeps reusing one long-lived
+                                session, rather than opening a new one for every
+                                query. Default True.
         """
 
         uri = "%s:%d" % (host, port)
 
-        self._driver = GraphDatabase.driver(uri, auth=(user, pswd), encrypted=False)
+        self._driver = GraphDatabase.driver(
+            uri,
+            auth=(user, pswd),
+            encrypted=False,
+            max_connection_pool_size=max_pool_size
+        )
+        self._keep_sessions = keep_sessions
+
+        # Sessions are not thread-safe, so every thread gets its own
+        # session and, possibly, its own open transaction
+        self._local = threading.local()
+
+    def _get_session(self):
+        """
+                Private method that returns the long-lived session of the
+                current thread, opening a new one if there is none yet
+
+        :return:                The session
+        """
+        session = getattr(self._local, 'session', None)
+
+        if session is None or session.closed():
+            session = self._driver.session()
+            self._local.session = session
+
+        return session
+
+    def _close_session(self):
+        """
+                Private method that closes the long-lived session
+                of the current thread, if there is one
+
+        :return:                -
+        """
+        session = getattr(self._local, 'session', None)
+
+        if session is not None:
+            session.close()
+            self._local.session = None
+
+    def close_session(self):
+        """
+                Method that closes the long-lived session of the current thread,
+                if there is one. Threads that stop using the driver before it is
+                closed, e.g. the ones of a thread pool, have to call it.
+
+        :return:                -
+        """
+        self._close_session()
+
+    @contextmanager
+    def transaction(self):
+        """
+                Context manager that runs every query executed through
+                execute_query() from the current thread, while inside the
+                'with' block, in one read transaction:
+
+                    with driver.transaction():
+                        driver.execute_query(...)
+                        driver.execute_query(...)
+
+                Nested blocks reuse the outer transaction.
+
+        :return:                The driver itself
+        """
+        if getattr(self._local, 'tx', None) is not None:
+            yield self
+            return
+
+        session = self._get_session() if self._keep_sessions else self._driver.session()
+        tx = session.begin_transaction()
+        self._local.tx = tx
+
+        try:
+            yield self
+            tx.success = True
+        finally:
+            self._local.tx = None
+            tx.close()
+            if not self._keep_sessions:
+                session.close()
 
     def execute_query(self,
                       query: str,
+                      parameters: dict=None,
                       **kwargs):
         """
                 Method that executes a given query and returns its result,
                 as a list of dictionaries.
 
-        :param query:           The query to be executed
-        :param kwargs:          The other parameters that are required for the query
+                Values should always be passed as parameters rather than
+                formatted into the query text, so that the database only
+                plans each distinct query text once.
+
+        :param query:           The query to be executed. Refers to its parameters as $name
+        :param parameters:      Dictionary of values bound to the parameters of the query.
+                                Default None.
+        :param kwargs:          The other parameters that are required for the query.
+                                They are bound in the same way as the ones in parameters.
         :return:
         """
-        session = self._driver.session()
+        tx = getattr(self._local, 'tx', None)
 
-        result = session.read_transaction(
-            lambda tx: tx.run(query)
-        )
+        if tx is not None:
+            records = tx.run(query, parameters, **kwargs).records()
+            return [dict(r.items()) for r in records]
 
-        records = result.records()
-        result = list()
+        session = self._get_session() if self._keep_sessions else self._driver.session()
 
-        for r in records:
-            result.append(dict(r.items()))
-
-        session.close()
+        try:
+            result = session.read_transaction(
+                lambda tx: tx.run(query, parameters, **kwargs)
+            )
+
+            records = result.records()
+            result = list()
+
+            for r in records:
+                result.append(dict(r.items()))
+        except Exception:
+            # The session might be broken, so make sure the
+            # next query gets a fresh one
+            if self._keep_sessions:
+                self._close_session()
+            raise
+        finally:
+            if not self._keep_sessions:
+                session.close()
 
         return result
 
+    def stream_query(self,
+                     query: str,
+                     parameters: dict=None,
+                     **kwargs):
+        """
+                Generator that executes a given query and yields its records
+                one by one, as dictionaries, as they are received from the
+                database, rather than loading all of them in memory.
+
+                The query runs in its own session, so the thread can keep
+                executing other queries while consuming the records.
+
+        :param query:           The query to be executed. Refers to its parameters as $name
+        :param parameters:      Dictionary of values bound to the parameters of the query.
+                                Default None.
+        :param kwargs:          The other parameters that are required for the query.
+                                They are bound in the same way as the ones in parameters.
+        :return:                Generator over the records of the query
+        """
+        session = self._driver.session()
+
+        try:
+            for r in session.run(query, parameters, **kwargs):
+                yield dict(r.items())
+        finally:
+            session.close()
+
     def close(self):
         """
             Method that closes the database connection
 
         :return:        -
         """
-
+        self._close_session()
         self._driver.close()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -23,6 +23,7 @@ from sklearn.utils import shuffle
 import random
 import json
 import os
+from operator import itemgetter
 
 
 def get_features_and_labels(df, label_cols):
@@ -381,7 +382,10 @@ def append_dict_to_df(new_data: dict,
 
 def process_list(data: list,
                  labels: list,
-                 features: list) -> (tuple, np.ndarray):
+                 features: list,
+                 max_neighbours: int=20,
+                 return_mask: bool=False,
+                 dtype=np.float64) -> (tuple, np.ndarray):
     """
         Function that gets a list in the format for GAT
         and returns:
@@ -390,79 +394,87 @@ def process_list(data: list,
                     a) X = the feature matrix for the nodes in the list
                          - np.ndarray with shape (len(data), 23)
 
-                    b) N = 3D np.ndarray, with dimension: (len(data), None, 23)
-                        it contains the neighbourhood data for the input vectors
+                    b) N = 3D np.ndarray, with dimension: (len(data), max_neighbours, 23)
+                        it contains the neighbourhood data for the input vectors,
+                        padded with zeros
 
                 2. An np.ndaray having shape (len(data), 2). It represents the
                 labels of the feature vectors
 
+                3. Only if return_mask is True, a boolean np.ndarray having shape
+                (len(data), max_neighbours), True where N holds an actual neighbour
+                rather than padding
+
+        All the arrays are preallocated and filled in place, one node at a time.
+
     :param data:            The input list of nodes, with their features
     :param labels:          The label names used when building the np.ndarray
     :param features:        The feature names used when building the feature
                             matrices
+    :param max_neighbours:  Up to how many neighbours are kept for every node. Default 20.
+    :param return_mask:     Whether to also return the padding mask or not. Default False.
+    :param dtype:           The type of the values of X, N and Y. Default np.float64, i.e. no
+                            precision is lost.
 
     :return:                Listed above
     """
 
     assert len(data) > 0
 
-    X_df = pd.DataFrame(
-        columns=features
-    )
-
-    Y_df = pd.DataFrame(
-        columns=labels
-    )
-
-    N_list = list()
+    get_features = itemgetter(*features)
+    get_labels = itemgetter(*labels)
 
     print("Starting to process the list. %d nodes to process." % len(data))
 
-    cnt_done = 0
+    X = np.empty(
+        shape=(len(data), len(features)),
+        dtype=dtype
+    )
 
     N = np.zeros(
-        shape=(len(data), 20, len(features))
+        shape=(len(data), max_neighbours, len(features)),
+        dtype=dtype
     )
 
-    for idx in range(len(data)):
+    Y = np.empty(
+        shape=(len(data), len(labels)),
+        dtype=dtype
+    )
+
+    mask = np.zeros(
+        shape=(len(data), max_neighbours),
+        dtype=bool
+    )
+
+    for idx, node in enumerate(data):
         # Adding node to feature matrix
-        node = data[idx]
-        self = node['self']
-        X_df = append_dict_to_df(new_data=self, df=X_df)
+        X[idx] = get_features(node['self'])
 
         # Now moving onto neighbours
-        neighs_df = pd.DataFrame(
-            columns=features
-        )
-        try:
-            for neigh in node['neighs'][:20]:
-                neighs_df = append_dict_to_df(new_data=neigh, df=neighs_df)
-        except KeyError:
+        if 'neighs' not in node:
             print(node)
+            neighs = list()
+        else:
+            neighs = node['neighs']
 
-        N_list.append(
-            neighs_df.as_matrix(columns=features)
-        )
+        # A node without neighbours has its own features as neighbourhood
+        if isinstance(neighs, dict):
+            neighs = [neighs]
 
-        N[idx, :len(neighs_df), :] = neighs_df.as_matrix(columns=features)
+        neighs = [neigh for neigh in neighs if neigh is not None][:max_neighbours]
 
-        # And now the labels
-        Y_df = append_dict_to_df(
-            new_data={
-                'SHOW': node['SHOW'],
-                'HIDE': node['HIDE']
-            },
-            df=Y_df
-        )
+        for n_idx, neigh in enumerate(neighs):
+            N[idx, n_idx] = get_features(neigh)
+
+        mask[idx, :len(neighs)] = True
 
-        cnt_done += 1
-        # print("%d/ %d Done!" % (cnt_done, len(data)))
+        # And now the labels
+        Y[idx] = get_labels(node)
 
     print("Done!")
 
-    X = X_df.as_matrix(columns=features)
-    Y = Y_df.as_matrix(columns=labels)
-    # N = np.array(N_list)
+    if return_mask:
+        return X, N, Y, mask
 
     return X, N, Y
 
@@ -19,6 +19,7 @@ limitations under the License.
 
 from models import get_model
 from data.neo4J.database_driver import AnotherDatabaseDriver
+from data.features.queries import QUERIES
 from server.cache import CacheHandler
 from models.config import PredictConfig
 from server.jobs import JobsHandler
@@ -27,7 +28,6 @@ from cypher_statements.config import RULES_TO_RUN
 import json
 import urllib.request
 import ssl
-import time
 
 
 def send_data(data, suffix):
@@ -51,11 +51,7 @@ def send_data(data, suffix):
 
 def get_random_nodes(n, driver):
 
-    q = 'match(n) ' \
-        'where "File" in labels(n)' \
-        'return n.uuid as uuid, n.timestamp as timestamp limit %d' % n
-
-    return driver.execute_query(q)
+    return driver.execute_query(QUERIES['random-files'], {'limit': n})
 
 
 def main(nodes):
@@ -70,21 +66,22 @@ def main(nodes):
 
     id = result['jobID']
 
-    print("Sleeping for 5 seconds...")
-    time.sleep(1)
-    print("Done... Let's see how the job is doing")
+    # Waiting for the job to finish, without polling: the server answers
+    # as soon as the status of the job changes
+    status = None
+    while status not in ['DONE', 'STOPPED']:
+        path = '/job-wait?id=%s&timeout=30' % id
+        if status is not None:
+            path += '&status=%s' % status
 
-    path = '/job-action?action=results&id=%s' % id
-    url = 'http://127.0.0.1:5000%s' % path
+        req = urllib.request.Request('http://127.0.0.1:5000%s' % path)
+        response = urllib.request.urlopen(req)
+        status = json.loads(response.read())['status']
 
-    req = urllib.request.Request(url)
-    response = urllib.request.urlopen(req)
-    data = json.loads(response.read())
-
-    print('Job status is: %s' % data['status'])
+        print('Job status is: %s' % status)
 
-    print('Sleeping for a couple more seconds')
-    time.sleep(15)
+    path = '/job-action?action=results&id=%s' % id
+    url = 'http://127.0.0.1:5000%s' % path
 
     req = urllib.request.Request(url)
     response = urllib.request.urlopen(req)
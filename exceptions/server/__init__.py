@@ -27,4 +27,16 @@ class InvalidJobStatus(CustomException):
 
         message = "Invalid job status provided. Expected %s, got %s." % (", ".join(valids), status)
 
-        CustomException.__init__(self, message)
\ No newline at end of file
+        CustomException.__init__(self, message)
+
+
+class JobResultsNotCached(CustomException):
+    """
+        Class representing a failure to write the results of a job to the cache
+    """
+    def __init__(self,
+                 jobID: str):
+
+        message = "Failed to cache the results of job %s." % jobID
+
+        CustomException.__init__(self, message)
@@ -35,6 +35,15 @@ class ModelConfig(object):
     INPUT_DIM = (23, )
     INPUT_DIM_ATTN = (23, None, )
 
+    PNN_CHUNK_SIZE = 256  # How many input rows the PNN evaluates its kernel for at once
+
+    # Spatial index used by the PNN to only evaluate its kernel for the stored
+    # vectors close to the input. One of None (exact, evaluates all of them) or 'kdtree'.
+    PNN_INDEX = None
+    # Kernel values below this are ignored when PNN_INDEX is set. Smaller values are
+    # more accurate, but slower, as they make the PNN look further away from the input.
+    PNN_KERNEL_TOLERANCE = 1e-8
+
 
 class TrainConfig(ModelConfig):
     """
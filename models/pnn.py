@@ -6,6 +6,8 @@ from models.model import Model
 from data.features.constants import *
 from models.config import *
 from pickle import dump, load
+from scipy.spatial import cKDTree
+from scipy.sparse import coo_matrix
 
 from data.utils import read_csv, split_dataframe, dump_json, get_new_filename_in_dir
 
@@ -29,6 +31,9 @@ class ProbabilisticNeuralNetwork(Model):
         self.sigma = None
         self.name = 'pnn'
 
+        self._index = None
+        self._cutoff = None
+
     def _normalize(self,
                    array: np.ndarray):
         """
@@ -43,47 +48,121 @@ class ProbabilisticNeuralNetwork(Model):
 
         return np.array(array / factor)
 
-    def _product_with_weight(self,
-                             X: np.ndarray,
-                             idx: int):
+    def _get_kernel_values(self,
+                           X: np.ndarray,
+                           weights_sq: np.ndarray) -> np.ndarray:
+        """
+            Private method that evaluates the Gaussian kernel between a set of
+            input vectors and every stored training vector, using matrix operations
+
+        :param X:               The input vectors, with shape (n, d)
+        :param weights_sq:      The squared norms of the stored training vectors, with shape (m, )
+        :return:                The kernel values, with shape (n, m)
+        """
+        sq_dists = np.sum(X ** 2, axis=1)[:, np.newaxis] + weights_sq[np.newaxis, :] \
+            - 2 * np.dot(X, self.weights.T)
+
+        # Rounding errors can make the distance to an identical vector slightly negative
+        np.maximum(sq_dists, 0, out=sq_dists)
+
+        return 1/(np.sqrt(2*np.pi)) * np.exp(-0.5 * sq_dists)
+
+    def _build_index(self) -> None:
+        """
+            Private method that (re)builds the spatial index over the stored
+            training vectors, if the configuration asks for one
+
+        :return:          -
+        """
+        if self.config.PNN_INDEX is None or self.weights is None:
+            self._index = None
+            return
+
+        assert self.config.PNN_INDEX == 'kdtree'
+
+        self._index = cKDTree(np.asarray(self.weights, dtype=float))
+
+        # exp(-d^2 / 2) < tolerance  <=>  d > sqrt(-2 * ln(tolerance))
+        self._cutoff = np.sqrt(-2 * np.log(self.config.PNN_KERNEL_TOLERANCE))
+
+    def _get_exact_parzen_estimates(self,
+                                    X: np.ndarray,
+                                    weights_sq: np.ndarray) -> np.ndarray:
         """
+            Private method that computes the Parzen estimates for a chunk of
+            input vectors, by evaluating the kernel for every stored training vector
 
-        :param X:           The vector to multiply the weight with
-        :param idx:         The weight index
-        :return:            The resulting product
+        :param X:               The input vectors
+        :param weights_sq:      The squared norms of the stored training vectors
+        :return:                The corresponding Parzen estimates
         """
-        return - np.sum(
-            [
-                ((X[i] - self.weights[idx, i]) ** 2) * 0.5
-                for i in range(len(X))
-            ]
+        return np.dot(
+            self._get_kernel_values(X, weights_sq),
+            self.As
         )
 
+    def _get_indexed_parzen_estimates(self,
+                                      X: np.ndarray,
+                                      weights_sq: np.ndarray) -> np.ndarray:
+        """
+            Private method that computes the Parzen estimates for a chunk of
+            input vectors, only evaluating the kernel for the stored training vectors
+            found by the spatial index within the cutoff radius. The input vectors
+            with no stored vector within the radius fall back to the exact computation.
+
+        :param X:               The input vectors
+        :param weights_sq:      The squared norms of the stored training vectors
+        :return:                The corresponding Parzen estimates
+        """
+        # All the (input, stored vector) pairs within the cutoff radius, at once
+        pairs = cKDTree(X).sparse_distance_matrix(
+            self._index,
+            max_distance=self._cutoff,
+            output_type='ndarray'
+        )
+
+        kernel = 1/(np.sqrt(2*np.pi)) * np.exp(-0.5 * pairs['v'] ** 2)
+
+        results = coo_matrix(
+            (kernel, (pairs['i'], pairs['j'], )),
+            shape=(len(X), len(self.weights))
+        ).dot(self.As)
+
+        isolated = np.bincount(pairs['i'], minlength=len(X)) == 0
+
+        if np.any(isolated):
+            results[isolated, :] = self._get_exact_parzen_estimates(X[isolated, :], weights_sq)
+
+        return results
+
     def _get_parzen_estimates(self,
                               data: np.ndarray) -> np.ndarray:
         """
-            Private method that, based on a set of input feature vectors
+            Private method that, based on a set of input feature vectors, computes
+            the Parzen estimates for every class. The input is processed in chunks
+            of config.PNN_CHUNK_SIZE rows, so that memory stays bounded.
 
         :param data:      The list of feature vectors to process
         :return:          The corresponding Parzen estimates
         """
+        data = np.asarray(data, dtype=float)
 
         results = np.empty(
             shape=(len(data), len(self.config.LABELS)),
             dtype=float
         )
 
-        for i in range(len(data)):
-            X = data[i, :]
-            g_SHOW = 0.0
-            g_HIDE = 0.0
-            for j in range(len(self.weights)):
-                z = self._product_with_weight(X, j)
-                exp = 1/(np.sqrt(2*np.pi)) * np.exp(z)
-                g_SHOW += self.As[j, 0] * exp
-                g_HIDE += self.As[j, 1] * exp
+        weights_sq = np.sum(self.weights ** 2, axis=1)
+        chunk_size = self.config.PNN_CHUNK_SIZE
 
-            results[i, :] = np.array([g_SHOW, g_HIDE])
+        if self._index is not None:
+            estimate = self._get_indexed_parzen_estimates
+        else:
+            estimate = self._get_exact_parzen_estimates
+
+        for start in range(0, len(data), chunk_size):
+            X = data[start:start + chunk_size, :]
+            results[start:start + chunk_size, :] = estimate(X, weights_sq)
 
         return results
 
@@ -106,6 +185,8 @@ class ProbabilisticNeuralNetwork(Model):
         self.As = get(file2)
         self.sigma = get(file3)
 
+        self._build_index()
+
     def save_checkpoint(self,
                         path: str) -> None:
         """
@@ -180,6 +261,7 @@ class ProbabilisticNeuralNetwork(Model):
         self.sigma = np.array(sigmas)
 
         self.built = True
+        self._build_index()
 
         if save_checkpoint:
             self.save_checkpoint(
@@ -231,9 +313,10 @@ class ProbabilisticNeuralNetwork(Model):
             dtype=float
         )
 
-        for idx in range(len(probs)):
-            probs[idx, 0] = parzen_est[idx, 0] / (parzen_est[idx, 0] + parzen_est[idx, 1])
-            probs[idx, 1] = parzen_est[idx, 1] / (parzen_est[idx, 0] + parzen_est[idx, 1])
+        totals = parzen_est[:, 0] + parzen_est[:, 1]
+
+        probs[:, 0] = parzen_est[:, 0] / totals
+        probs[:, 1] = parzen_est[:, 1] / totals
 
         return probs
 
@@ -1,9 +1,9 @@
 from flask import Flask, request, Response, jsonify
 #from server.config import Config
 from server.cache import CacheHandler
+from server.cache.sweeper import CacheSweeper
+from server.cache.events import JobEventBus, JobEventListener
 from data.neo4J.database_driver import AnotherDatabaseDriver
-from models import get_model
-from models.config import PredictConfig
 
 from server.views import *
 from server import utils
@@ -37,23 +37,50 @@ class API(Flask):
 
         self.cacheConnData = config.CACHE_CONN_DATA
 
+        # The workers are forked before the API opens any connection to the cache
+        # database, so that they don't inherit connections it keeps using
+        utils.jobsHandler = JobsHandler(
+            cacheConnData=config.CACHE_CONN_DATA,
+            neo4jConnData=config.NEO4J_CONN_DATA,
+            defaultTTL=config.TTL,
+            defaultModel=config.MODEL,
+            maxConcurrentJobs=config.MAX_CONCURRENT_JOBS,
+            maxWaitingJobs=config.MAX_WAITING_JOBS,
+            jobBatchSize=config.JOB_BATCH_SIZE
+        )
+
         utils.cacheHandler = CacheHandler(
             user=self.cacheConnData['user'],
             password=self.cacheConnData['password'],
             host=self.cacheConnData['host'],
             port=self.cacheConnData['port'],
-            dbName=self.cacheConnData['dbName']
+            dbName=self.cacheConnData['dbName'],
+            minConn=self.cacheConnData['minConn'],
+            maxConn=self.cacheConnData['maxConn'],
+            defaultTTL=config.TTL,
+            # The API process never looks up node results
+            lruSize=None,
+            statusLRUSize=self.cacheConnData['statusLRUSize']
         )
 
-        utils.jobsHandler = JobsHandler(
-            cacheConnData=config.CACHE_CONN_DATA,
-            neo4jConnData=config.NEO4J_CONN_DATA,
-            defaultTTL=config.TTL,
-            defaultModel=config.MODEL
+        # Caching the results relies on the unique indexes, which
+        # an existing cache database might not have yet
+        utils.cacheHandler.postgresDriver.prepare_database()
+
+        # Started after the workers were forked, so that they don't inherit it
+        self.cacheSweeper = CacheSweeper(
+            cacheHandler=utils.cacheHandler,
+            interval=config.CACHE_SWEEP['interval'],
+            batchSize=config.CACHE_SWEEP['batchSize'],
+            pause=config.CACHE_SWEEP['pause']
         )
+        self.cacheSweeper.start()
+
+        # The workers notify the job updates through the cache database
+        utils.jobEvents = JobEventBus()
 
-        utils.model = get_model(
-            name=config.MODEL['name'],
-            config=PredictConfig,
-            checkpoint=config.MODEL['checkpoint']
+        self.jobEventListener = JobEventListener(
+            bus=utils.jobEvents,
+            postgresDriver=utils.cacheHandler.postgresDriver
         )
+        self.jobEventListener.start()
@@ -18,10 +18,18 @@ limitations under the License.
 """
 from datetime import datetime as dt
 from numpy import random
+import numpy as np
+import psycopg2
+import logging
 
 from server.cache.driver import PostgresDriver
+from data.lru import LRUCache
 from server.cache.constants import *
 from exceptions.server import *
+from exceptions.server.cache import PostgressNoActiveConnection
+from data.features.constants import FEATURES_ONE_HOT
+
+logger = logging.getLogger(__name__)
 
 
 class CacheHandler(object):
@@ -33,7 +41,12 @@ class CacheHandler(object):
                  host: str,
                  user: str,
                  password: str,
-                 port: int):
+                 port: int,
+                 minConn: int=1,
+                 maxConn: int=10,
+                 defaultTTL: int=DEFAULT_TTL,
+                 lruSize: int=LRU_SIZE,
+                 statusLRUSize: int=JOB_STATUS_LRU_SIZE):
         """
 
         :param dbName:
@@ -41,13 +54,32 @@ class CacheHandler(object):
         :param user:
         :param password:
         :param port:
+        :param minConn:         Number of connections kept open to the cache database. Default 1.
+        :param maxConn:         Maximum number of connections to the cache database. Default 10.
+        :param defaultTTL:      Number of seconds a cached result is valid for, when no
+                                time-to-live is given. Default DEFAULT_TTL.
+        :param lruSize:         Number of node results kept in memory, in front of the
+                                cache database. 0 or None disables it. Default LRU_SIZE.
+        :param statusLRUSize:   Number of finished job statuses kept in memory, in front of
+                                the cache database. 0 or None disables it. Default JOB_STATUS_LRU_SIZE.
         """
+        self.defaultTTL = defaultTTL
+
+        # In-process tier in front of the cache database, mapping
+        # (uuid, timestamp, ) to the classification results of the node
+        self.lru = LRUCache(lruSize) if lruSize else None
+
+        # Mapping the public ID of a finished job to its status, which never changes again
+        self.statusLRU = LRUCache(statusLRUSize) if statusLRUSize else None
+
         self.postgresDriver = PostgresDriver(
             host=host,
             port=port,
             user=user,
             password=password,
-            dbName=dbName
+            dbName=dbName,
+            minConn=minConn,
+            maxConn=maxConn
         )
 
     def _exists_node(self,
@@ -151,6 +183,27 @@ class CacheHandler(object):
         except:
             return None
 
+    def count_jobs_with_status(self,
+                               status: str):
+        """
+            Method that counts the jobs that currently have a given status
+
+        :param status:              The status we're interested in
+
+        :return:                    The number of jobs - if successful
+                                    None - otherwise
+        :raises AssertionError:     If the status provided is not one of WAITING, RUNNING, STOPPED or DONE
+        """
+        assert(status in ACCEPTED_JOB_STATUS)
+
+        query = SELECTS['jobs-by-status']
+        results = self.postgresDriver.execute_SELECT(query, status)
+
+        if results is None or len(results) == 0:
+            return None
+
+        return results[0][0]
+
     def add_new_job(self,
                     jobID: str,
                     startedAt=None,
@@ -179,11 +232,14 @@ class CacheHandler(object):
 
     def update_job_status(self,
                           jobID: str,
-                          newStatus: str):
+                          newStatus: str,
+                          fromStatus: list=None):
         """"
 
         :param jobID:                The public job ID for which we perform the update
         :param newStatus:              The new status of the job
+        :param fromStatus:          If provided, the job is only updated if its current status
+                                    is one of these. Default None.
 
         :return:                    True - if successful
                                     False - otherwise
@@ -191,48 +247,100 @@ class CacheHandler(object):
         """
         assert(newStatus in ACCEPTED_JOB_STATUS)
 
+        if self.statusLRU is not None:
+            self.statusLRU.invalidate(jobID)
 
-        query = UPDATES['job-status']
-        self.postgresDriver.execute_UPDATE(
+        if fromStatus is None:
+            query = UPDATES['job-status']
+            self.postgresDriver.execute_UPDATE(
+                query,
+                newStatus, jobID
+            )
+            self.notify_job_update(jobID)
+            return True
+
+        query = UPDATES['job-status-from']
+        updated = self.postgresDriver.execute_UPDATE(
             query,
-            newStatus, jobID
+            newStatus, newStatus, jobID, list(fromStatus)
         )
+
+        if updated == 0:
+            return False
+
+        self.notify_job_update(jobID)
         return True
 
+    def notify_job_update(self,
+                          jobID: str):
+        """
+                Method that lets the clients waiting on a job know that its status
+                changed or that new results were cached
+
+        :param jobID:       The public ID of the job
+
+        :return:            True - if successful
+                            False - otherwise
+        """
+        return self.postgresDriver.execute_SELECT(
+            SELECTS['notify'],
+            JOB_EVENTS_CHANNEL, jobID
+        ) is not None
+
+    def start_job(self,
+                  jobID: str):
+        """
+                Method that changes a job's status from 'WAITING' to 'RUNNING'
+
+        :param jobID:       The public ID of the job
+
+        :return:            True - if successful
+                            False - otherwise, e.g. if the job was stopped while waiting
+        """
+        return self.update_job_status(jobID, 'RUNNING', ['WAITING'])
+
     def stop_job(self,
                  jobID:str):
         """
-                Method that changes the a job's status to 'STOPPED'
+                Method that changes the a job's status to 'STOPPED', if it is
+                still waiting or running
 
         :param jobID:       The public ID of the job we want to update the status for
 
         :return:            True - if successful
                             False - otherwise
         """
-        return self.update_job_status(jobID, 'STOPPED')
+        return self.update_job_status(jobID, 'STOPPED', ['WAITING', 'RUNNING'])
 
     def mark_job_as_done(self,
                          jobID:str):
         """
-                Method that updates a job's status to 'DONE'
+                Method that updates a job's status to 'DONE', if it is running
 
         :param jobID:       The public ID of the job
 
         :return:            True - if successful
-                            False - otherwise
+                            False - otherwise, e.g. if the job was stopped
         """
-        return self.update_job_status(jobID, 'DONE')
+        return self.update_job_status(jobID, 'DONE', ['RUNNING'])
 
     def get_job_status(self,
                        jobID:str):
         """
-            Method that returns the cached status of a job
+            Method that returns the cached status of a job. The status of a finished
+            job is kept in memory, so polling it again doesn't query the database.
 
         :param jobID:       The public job ID
 
         :return:            The job status - if successful
                             None - if not successful
         """
+        if self.statusLRU is not None:
+            status = self.statusLRU.get(jobID)
+
+            if status is not None:
+                return status
+
         query = SELECTS['job-status']
 
         status = self.postgresDriver.execute_SELECT(query, jobID)
@@ -240,7 +348,12 @@ class CacheHandler(object):
         if status is None or len(status) == 0:
             return None
 
-        return status[0][0]
+        status = status[0][0]
+
+        if self.statusLRU is not None and status in FINAL_JOB_STATUS:
+            self.statusLRU.put(jobID, status)
+
+        return status
 
     def add_node_to_job_rel(self,
                             uuid: str,
@@ -281,6 +394,8 @@ class CacheHandler(object):
                      override:bool=True,
                      classifiedbY:str='N/A'):
         """
+                Method that caches the results of a node and links it to a job,
+                in a single statement
 
         :param jobID:                   The job the node belongs to
         :param uuid:                    The uuid of the node
@@ -288,17 +403,62 @@ class CacheHandler(object):
         :param showProb:                Probability that the node should be shown
         :param hideProb:                Probability that the node should be hidden
         :param recommended:             Recommended action(i.e. 'SHOW' or 'HIDE')
-        :param ttl:                     Time-to-live for this cached value
+        :param ttl:                     Time-to-live for this cached value, in seconds.
+                                    Default None, i.e. the default TTL of the handler
         :param override:                Whether to override the cache entry if the node
-                                    was already entered or not
+                                    was already entered or not. An expired entry is
+                                    always overridden.
         :param classifiedbY:            The name of the classifier used by the node
 
         :return:                        True - if successful
                                         False - otherwise
         """
-        assert(recommended in ['SHOW', 'HIDE'] or recommended is None)
+        return self.add_nodes_results(
+            jobID=jobID,
+            results=[{
+                'uuid': uuid,
+                'timestamp': timestamp,
+                'showProb': showProb,
+                'hideProb': hideProb,
+                'recommended': recommended,
+                'classifiedBy': classifiedbY
+            }],
+            override=override,
+            ttl=ttl
+        )
 
-        self.postgresDriver.reset_connection()
+    def add_nodes_results(self,
+                          jobID: str,
+                          results: list,
+                          override: bool=True,
+                          ttl: int=None):
+        """
+                Method that caches the results of many nodes of the same job
+                and links them to it at once, in a single statement
+
+        :param jobID:                   The job the nodes belong to
+        :param results:                 The results, as a list of dictionaries with the format:
+                                            {
+                                                'uuid':         the uuid of the node,
+                                                'timestamp':    the timestamp of the node,
+                                                'showProb':     probability that the node should be shown,
+                                                'hideProb':     probability that the node should be hidden,
+                                                'recommended':  recommended action (i.e. 'SHOW' or 'HIDE'),
+                                                'classifiedBy': the name of the classifier used
+                                            }
+        :param override:                Whether to override the cache entries of the nodes
+                                    that were already entered or not. Expired entries
+                                    are always overridden.
+        :param ttl:                     Time-to-live for these cached values, in seconds.
+                                    Default None, i.e. the default TTL of the handler
+
+        :return:                        True - if successful
+                                        False - otherwise
+        """
+        assert(all(r['recommended'] in ['SHOW', 'HIDE'] or r['recommended'] is None for r in results))
+
+        if len(results) == 0:
+            return True
 
         jobInnerID = self._get_job_id(jobID)
 
@@ -306,62 +466,57 @@ class CacheHandler(object):
             # The jobID is not valid!! Therefore, fail!
             return False
 
-        # First, checking if the node already exists in the database
-        nodeInnerID = self._get_node_id(uuid, timestamp)
-
-        if nodeInnerID is not None:
-
-            query = INSERTS['node-to-job-rel']
-
-            try:
-                self.postgresDriver.execute_INSERT(query,
-                                                   jobInnerID, nodeInnerID)
-            except:
-                # The insert failed, thus return False
-                return False
+        ttl = ttl if ttl else self.defaultTTL
 
-            if not override:
-                # All done
-                return True
+        # One row per node, as an upsert can't touch the same row twice.
+        # The last result of a node wins.
+        rows = list({
+            (r['uuid'], r['timestamp'], ): (jobInnerID, r['uuid'], r['timestamp'], r['showProb'], r['hideProb'],
+                                            r['recommended'], r['classifiedBy'], ttl, )
+            for r in results
+        }.values())
 
-            # Otherwise, we need to update the database
+        query = INSERTS['upsert-nodes-for-job'] if override else INSERTS['insert-nodes-for-job']
 
-            query = UPDATES['node-results']
-
-            self.postgresDriver.execute_UPDATE(
-                query,
-                showProb, hideProb, recommended, uuid, timestamp
+        try:
+            self.postgresDriver.execute_VALUES(
+                query, rows, TEMPLATES['node-results-for-job']
             )
+        except psycopg2.Error:
+            logger.exception("Failed to cache the results of %d nodes for job %s", len(rows), jobID)
+            return False
 
-            try:
-
-
-                return True
-            except:
-                # The update failed, so return False
-                return False
-
-        # If the node wasn't already in the database,
-        # then we first need to add it as a new entry
-
-        query = INSERTS['new-node']
-
-        self.postgresDriver.execute_INSERT(
-            query,
-            uuid, timestamp, showProb, hideProb, recommended, classifiedbY
-        )
+        if override:
+            self._remember_results(results, ttl)
 
-        # Now getting the node ID
-        nodeInnerID = self._get_node_id(uuid=uuid, timestamp=timestamp)
+        return True
 
-        query = INSERTS['node-to-job-rel']
+    def _remember_results(self,
+                          results: list,
+                          ttl: float):
+        """
+            Private method that keeps the results just cached in memory as well
 
-        self.postgresDriver.execute_INSERT(
-            query,
-            jobInnerID, nodeInnerID
-        )
+        :param results:         The results, in the format taken by add_nodes_results
+        :param ttl:             Number of seconds the results are valid for
+        :return:                -
+        """
+        if self.lru is None:
+            return
 
-        return True
+        for result in results:
+            self.lru.put(
+                (result['uuid'], result['timestamp'], ),
+                {
+                    'uuid': result['uuid'],
+                    'timestamp': result['timestamp'],
+                    'showProb': result['showProb'],
+                    'hideProb': result['hideProb'],
+                    'recommended': result['recommended'],
+                    'classifiedBy': result['classifiedBy']
+                },
+                ttl
+            )
 
     def cache_valid(self,
                    uuid: str,
@@ -386,10 +541,236 @@ class CacheHandler(object):
         if status is None or len(status) == 0:
             # The node is not in the database
             return False
-        else:
-            status = status[0][0]
 
-            return status is None
+        # Entries without an expiry time are considered expired
+        return status[0][0] is True
+
+    def get_cached_results(self,
+                           nodes: list) -> dict:
+        """
+            Method that looks up many nodes in the cache at once. The nodes
+            not found in memory are looked up in the cache database, with a single query.
+
+        :param nodes:           The nodes to look for, as a list of
+                                {'uuid': ..., 'timestamp': ...} dictionaries
+
+        :return:                A dictionary containing only the nodes with a valid cache entry:
+                                    {
+                                        (uuid, timestamp, ): {
+                                            'uuid':         the uuid of the node,
+                                            'timestamp':    the timestamp of the node,
+                                            'showProb':     the cached probability it should be shown,
+                                            'hideProb':     the cached probability it should be hidden,
+                                            'recommended':  the cached recommendation,
+                                            'classifiedBy': the classifier used
+                                        }
+                                    }
+        """
+        rows = list(dict.fromkeys(
+            (node['uuid'], node['timestamp'], ) for node in nodes
+            if node['uuid'] is not None and node['timestamp'] is not None
+        ))
+
+        cached = dict()
+
+        if self.lru is not None:
+            missing = list()
+
+            for row in rows:
+                entry = self.lru.get(row)
+
+                if entry is None:
+                    missing.append(row)
+                else:
+                    cached[row] = dict(entry)
+
+            rows = missing
+
+        if len(rows) == 0:
+            return cached
+
+        results = self.postgresDriver.execute_VALUES(
+            SELECTS['cached-nodes-results'],
+            rows,
+            TEMPLATES['node'],
+            fetch=True
+        )
+
+        for result in results:
+            entry = {
+                'uuid': result[0],
+                'timestamp': result[1],
+                'showProb': result[2],
+                'hideProb': result[3],
+                'recommended': result[4],
+                'classifiedBy': result[5]
+            }
+
+            cached[(result[0], result[1], )] = entry
+
+            if self.lru is not None:
+                # The entry stays in memory only for as long as it is valid
+                self.lru.put((result[0], result[1], ), dict(entry), result[6])
+
+        return cached
+
+    def clear_lru(self):
+        """
+            Method that empties the in-memory tier of the cache
+
+        :return:                -
+        """
+        if self.lru is not None:
+            self.lru.clear()
+
+        if self.statusLRU is not None:
+            self.statusLRU.clear()
+
+    def get_lru_stats(self):
+        """
+            Method that returns the usage statistics of the in-memory tier of the cache
+
+        :return:                The statistics, as returned by LRUCache.stats() - if enabled
+                                None - otherwise
+        """
+        if self.lru is None:
+            return None
+
+        return self.lru.stats()
+
+    def link_cached_nodes(self,
+                          jobID: str,
+                          nodes: list):
+        """
+            Method that links many cached nodes to a job at once, checking that their
+            cache entries are still valid, e.g. for the ones found in memory
+
+        :param jobID:           The public ID of the job
+        :param nodes:           The nodes, as a list of {'uuid': ..., 'timestamp': ...} dictionaries
+
+        :return:                The set of (uuid, timestamp, ) pairs of the nodes linked - if successful
+                                None - otherwise
+        """
+        if len(nodes) == 0:
+            return set()
+
+        jobInnerID = self._get_job_id(jobID)
+
+        if jobInnerID is None:
+            return None
+
+        try:
+            linked = self.postgresDriver.execute_VALUES(
+                INSERTS['link-cached-nodes'],
+                [(jobInnerID, node['uuid'], node['timestamp'], ) for node in nodes],
+                TEMPLATES['node-for-job'],
+                fetch=True
+            )
+        except psycopg2.Error:
+            logger.exception("Failed to link %d cached nodes to job %s", len(nodes), jobID)
+            return None
+
+        linked = set((row[0], row[1], ) for row in linked)
+
+        if self.lru is not None:
+            # Not cached anymore, e.g. swept or cleared by another process
+            for node in nodes:
+                id = (node['uuid'], node['timestamp'], )
+
+                if id not in linked:
+                    self.lru.invalidate(id)
+
+        return linked
+
+    def get_feature_vectors(self,
+                            nodes: list) -> dict:
+        """
+            Method that looks up the stored feature vectors of many nodes at once
+
+        :param nodes:           The nodes to look for, as a list of
+                                {'uuid': ..., 'timestamp': ...} dictionaries
+
+        :return:                A dictionary containing only the nodes with a stored feature vector,
+                                mapping (uuid, timestamp, ) to the vector, as a dictionary
+                                with the FEATURES_ONE_HOT keys - if successful
+                                An empty dictionary - otherwise
+        """
+        rows = list(dict.fromkeys(
+            (node['uuid'], node['timestamp'], ) for node in nodes
+            if node['uuid'] is not None and node['timestamp'] is not None
+        ))
+
+        if len(rows) == 0:
+            return dict()
+
+        try:
+            results = self.postgresDriver.execute_VALUES(
+                SELECTS['cached-feature-vectors'],
+                rows,
+                TEMPLATES['node'],
+                fetch=True
+            )
+        except psycopg2.Error:
+            logger.exception("Failed to look up the feature vectors of %d nodes", len(rows))
+            return dict()
+
+        vectors = dict()
+
+        for result in results:
+            vector = np.frombuffer(result[2], dtype=np.float32)
+
+            if len(vector) != len(FEATURES_ONE_HOT):
+                # Stored before the features changed, so it is extracted again
+                continue
+
+            vectors[(result[0], result[1], )] = dict(
+                (feature, None if np.isnan(value) else float(value))
+                for feature, value in zip(FEATURES_ONE_HOT, vector)
+            )
+
+        return vectors
+
+    def add_feature_vectors(self,
+                            featureVectors: list):
+        """
+            Method that stores the feature vectors of many nodes at once
+
+        :param featureVectors:  The feature vectors, as a list of {'id', 'self'} entries,
+                                as returned by the feature extractor. The entries without
+                                a feature vector are skipped.
+
+        :return:                True - if successful
+                                False - otherwise
+        """
+        rows = dict()
+
+        for fv in featureVectors:
+            if fv['self'] is None:
+                continue
+
+            # Missing values are stored as NaN
+            vector = np.array(
+                [fv['self'][feature] if fv['self'][feature] is not None else np.nan
+                 for feature in FEATURES_ONE_HOT],
+                dtype=np.float32
+            )
+
+            rows[fv['id']] = (fv['id'][0], fv['id'][1], vector.tobytes(), )
+
+        if len(rows) == 0:
+            return True
+
+        try:
+            self.postgresDriver.execute_VALUES(
+                INSERTS['feature-vectors'],
+                list(rows.values()),
+                TEMPLATES['feature-vector']
+            )
+        except psycopg2.Error:
+            logger.exception("Failed to store the feature vectors of %d nodes", len(rows))
+            return False
+
+        return True
 
     def get_node_cache_entry(self,
                              uuid: str,
@@ -410,18 +791,46 @@ class CacheHandler(object):
 
         return results
 
+    def _result_from_row(self,
+                         row: tuple) -> dict:
+        """
+            Private method that turns a (uuid, timestamp, showProb, hideProb,
+            recommended, classifiedBy, ) row into a result dictionary
+
+        :param row:          The row
+        :return:             The result
+        """
+        return {
+            'uuid': row[0],
+            'timestamp': row[1],
+            'showProb': row[2],
+            'hideProb': row[3],
+            'recommended': row[4],
+            'classifiedBy': row[5]
+        }
+
     def get_nodes_for_job(self,
-                          jobID: str):
+                          jobID: str,
+                          cursor: int=None,
+                          limit: int=None):
         """
 
         :param jobID:        The id of the job we extract the classification results for
+        :param cursor:       Only return the results after this cursor, as returned in
+                             'nextCursor' by the previous page. Default None, i.e. from the start.
+        :param limit:        The maximum number of results to return. Default None, i.e. all of them.
         :return:             A dictionary with the following format:
 
                                 {
-                                    'status': <one of DONE, RUNNING or WAITING>
+                                    'status': <one of DONE, RUNNING or WAITING>,
+                                    'results': <the results>,
+                                    'nextCursor': <the cursor of the next page, or None if this
+                                                   is the last one. Only if a limit is given>
                                 }
 
         """
+        if limit is not None:
+            return self._get_nodes_page_for_job(jobID, cursor, limit)
 
         query = SELECTS['nodes-for-job']
 
@@ -451,12 +860,83 @@ class CacheHandler(object):
 
         return final_results
 
+    def _get_nodes_page_for_job(self,
+                                jobID: str,
+                                cursor: int,
+                                limit: int):
+        """
+            Private method that returns a page of the results of a job, using
+            keyset pagination on the job-node relations
+
+        :param jobID:        The id of the job
+        :param cursor:       The cursor the page starts after, or None
+        :param limit:        The maximum number of results in the page
+        :return:             Same as get_nodes_for_job()
+        """
+        assert limit > 0
+
+        status = self.get_job_status(jobID)
+
+        if status is None:
+            return None
+
+        # One extra row tells whether there is a next page
+        rows = self.postgresDriver.execute_SELECT(
+            SELECTS['nodes-for-job-page'],
+            jobID, cursor if cursor is not None else 0, limit + 1
+        )
+
+        if rows is None:
+            return None
+
+        page = rows[:limit]
+
+        return {
+            'status': status,
+            'results': [self._result_from_row(row[1:]) for row in page],
+            'nextCursor': page[-1][0] if len(rows) > limit else None
+        }
+
+    def stream_nodes_for_job(self,
+                             jobID: str):
+        """
+            Generator returning the results of a job one at a time, read from
+            the cache database through a server-side cursor
+
+        :param jobID:        The id of the job
+        :return:             The results, in the format of get_nodes_for_job()
+        """
+        for row in self.postgresDriver.stream_SELECT(SELECTS['nodes-for-job-stream'], jobID):
+            yield self._result_from_row(row)
+
+    def delete_expired(self,
+                       batchSize: int):
+        """
+            Method that removes up to batchSize expired entries from the cache,
+            in a transaction short enough not to hold back the running jobs
+
+        :param batchSize:       The maximum number of entries to remove
+
+        :return:                The number of entries removed - if successful
+                                None - otherwise
+        """
+        try:
+            return self.postgresDriver.execute_DELETE(
+                DELETES['expired-nodes'],
+                batchSize
+            )
+        except (psycopg2.Error, PostgressNoActiveConnection):
+            # Also raised once the driver is closed, e.g. while the server shuts down
+            logger.exception("Failed to remove the expired cache entries")
+            return None
+
     def clear_cache(self):
         """
             Method used to clear the cache database
 
         :return:        -
         """
+        self.clear_lru()
 
         for table in TABLES:
             query = DELETE_CUSTOM % table
@@ -18,7 +18,7 @@ limitations under the License.
 """
 
 DATABASE_SETUP = {
-    "jobs": "CREATE TABLE jobs (" 
+    "jobs": "CREATE TABLE IF NOT EXISTS jobs (" 
                 "id SERIAL PRIMARY KEY, "
                 "jobID VARCHAR(32) NOT NULL, "
                 "status VARCHAR(100) NOT NULL, "
@@ -26,18 +26,18 @@ DATABASE_SETUP = {
                 "stopped DATE"
             ")",
 
-    "nodes": "CREATE TABLE nodes ("
+    "nodes": "CREATE TABLE IF NOT EXISTS nodes ("
                 "id SERIAL PRIMARY KEY, "
                 "uuid VARCHAR(100) NOT NULL, "
                 "timemstmp BIGINT NOT NULL, "
                 "classifiedBy VARCHAR(50), "
-                "validUntil DATE, "
+                "validUntil TIMESTAMP, "
                 "showLikelihood FLOAT, "
                 "hideLikelihood FLOAT, "
                 "recommended VARCHAR(10) "
              ")",
 
-    "jobsToNodes": "CREATE TABLE jobsToNodes ( "
+    "jobsToNodes": "CREATE TABLE IF NOT EXISTS jobsToNodes ( "
                         "id SERIAL PRIMARY KEY, "
                         "jobID INT NOT NULL, "
                         "nodeID INT NOT NULL, "
@@ -49,15 +49,90 @@ DATABASE_SETUP = {
                             "REFERENCES nodes (id) "
                             "ON UPDATE CASCADE "
                             "ON DELETE CASCADE"
-                   ")"
+                   ")",
+
+    # Feature vectors of the nodes, independent of the model that classifies
+    # them. The vector is stored as packed float32 values, in FEATURES_ONE_HOT order.
+    "features": "CREATE TABLE IF NOT EXISTS features ("
+                    "id SERIAL PRIMARY KEY, "
+                    "uuid VARCHAR(100) NOT NULL, "
+                    "timemstmp BIGINT NOT NULL, "
+                    "vector BYTEA NOT NULL"
+                ")"
 }
 
+# Indexes backing the lookups the cache does on every request. The unique ones
+# also guarantee there is at most one entry for every node (uuid, timestamp),
+# job ID and (job, node) pair.
+DATABASE_INDEXES = {
+    "nodes_uuid_timemstmp": "CREATE UNIQUE INDEX IF NOT EXISTS nodes_uuid_timemstmp "
+                                "ON nodes (uuid, timemstmp)",
+
+    "jobs_jobid": "CREATE UNIQUE INDEX IF NOT EXISTS jobs_jobid "
+                        "ON jobs (jobID)",
+
+    "jobs_status": "CREATE INDEX IF NOT EXISTS jobs_status "
+                        "ON jobs (status)",
+
+    "jobstonodes_jobid_nodeid": "CREATE UNIQUE INDEX IF NOT EXISTS jobstonodes_jobid_nodeid "
+                                    "ON jobsToNodes (jobID, nodeID)",
+
+    "jobstonodes_nodeid": "CREATE INDEX IF NOT EXISTS jobstonodes_nodeid "
+                                "ON jobsToNodes (nodeID)",
+
+    "jobstonodes_jobid_id": "CREATE INDEX IF NOT EXISTS jobstonodes_jobid_id "
+                                "ON jobsToNodes (jobID, id)",
+
+    "nodes_validuntil": "CREATE INDEX IF NOT EXISTS nodes_validuntil "
+                            "ON nodes (validUntil)",
+
+    "features_uuid_timemstmp": "CREATE UNIQUE INDEX IF NOT EXISTS features_uuid_timemstmp "
+                                    "ON features (uuid, timemstmp)"
+}
+
+# Statements bringing a cache database created before the indexes above
+# existed up to date, by removing the duplicates that would violate them.
+# They are run in order, in a single transaction.
+DATABASE_MIGRATIONS = [
+    # Expiry times used to be dates and were never written. The entries
+    # without one are marked as expired, so that the sweeper removes them.
+    "ALTER TABLE nodes ALTER COLUMN validUntil TYPE TIMESTAMP",
+
+    "UPDATE nodes SET validUntil=now() WHERE validUntil IS NULL",
+
+    # Duplicate nodes: the relations are moved to the most recent entry,
+    # then the older entries are removed
+    "UPDATE jobsToNodes AS jtn "
+        "SET nodeID=d.keepID "
+        "FROM (SELECT id, max(id) OVER (PARTITION BY uuid, timemstmp) AS keepID FROM nodes) AS d "
+    "WHERE jtn.nodeID=d.id AND d.id<>d.keepID",
+
+    "DELETE FROM nodes AS n "
+        "USING nodes AS m "
+    "WHERE n.uuid=m.uuid AND n.timemstmp=m.timemstmp AND n.id<m.id",
+
+    # Duplicate jobs: same, keeping the first entry
+    "UPDATE jobsToNodes AS jtn "
+        "SET jobID=d.keepID "
+        "FROM (SELECT id, min(id) OVER (PARTITION BY jobID) AS keepID FROM jobs) AS d "
+    "WHERE jtn.jobID=d.id AND d.id<>d.keepID",
+
+    "DELETE FROM jobs AS j "
+        "USING jobs AS k "
+    "WHERE j.jobID=k.jobID AND j.id>k.id",
+
+    # Duplicate relations
+    "DELETE FROM jobsToNodes AS a "
+        "USING jobsToNodes AS b "
+    "WHERE a.jobID=b.jobID AND a.nodeID=b.nodeID AND a.id>b.id"
+]
+
 SELECTS = {
     'jobID': 'SELECT jobs.id '
                 'FROM jobs '
              'WHERE jobs.jobID=%s',
 
-    'node-cache-status': 'SELECT validuntil '
+    'node-cache-status': 'SELECT validuntil > now() '
                             'FROM nodes '
                         'WHERE uuid=%s AND timemstmp=%s',
 
@@ -71,6 +146,22 @@ SELECTS = {
                         'INNER JOIN jobs as j ON jtn.jobid=j.id '
                      'WHERE j.jobid=%s',
 
+    # Keyset pagination: the results of a job after a given relation id, in order
+    'nodes-for-job-page': 'SELECT jtn.id, n.uuid, n.timemstmp, n.showlikelihood, n.hidelikelihood, n.recommended, n.classifiedby '
+                            'FROM jobs AS j '
+                            'INNER JOIN jobsToNodes AS jtn ON jtn.jobid=j.id '
+                            'INNER JOIN nodes AS n ON n.id=jtn.nodeid '
+                          'WHERE j.jobid=%s AND jtn.id > %s '
+                          'ORDER BY jtn.id '
+                          'LIMIT %s',
+
+    'nodes-for-job-stream': 'SELECT n.uuid, n.timemstmp, n.showlikelihood, n.hidelikelihood, n.recommended, n.classifiedby '
+                                'FROM jobs AS j '
+                                'INNER JOIN jobsToNodes AS jtn ON jtn.jobid=j.id '
+                                'INNER JOIN nodes AS n ON n.id=jtn.nodeid '
+                            'WHERE j.jobid=%s '
+                            'ORDER BY jtn.id',
+
     'job-status': 'SELECT jobs.status '
                     'FROM jobs '
                   'WHERE jobs.jobID=%s',
@@ -92,6 +183,29 @@ SELECTS = {
               'FROM nodes '
               'WHERE nodes.uuid=%s AND nodes.timemstmp=%s',
 
+    'cached-nodes-results': 'SELECT n.uuid, n.timemstmp, n.showlikelihood, n.hidelikelihood, n.recommended, n.classifiedby, '
+                                   'extract(epoch FROM n.validuntil - now())::float8 AS ttl '
+                                'FROM nodes AS n '
+                                'INNER JOIN (VALUES %s) AS v(uuid, timemstmp) '
+                                    'ON n.uuid=v.uuid AND n.timemstmp=v.timemstmp '
+                            'WHERE n.validuntil > now()',
+
+    'cached-feature-vectors': 'SELECT f.uuid, f.timemstmp, f.vector '
+                                    'FROM features AS f '
+                                    'INNER JOIN (VALUES %s) AS v(uuid, timemstmp) '
+                                        'ON f.uuid=v.uuid AND f.timemstmp=v.timemstmp',
+
+    'notify': 'SELECT pg_notify(%s, %s)',
+
+    # Tell whether an existing cache database needs migrating
+    'existing-indexes': 'SELECT count(*) '
+                            'FROM pg_indexes '
+                        'WHERE indexname IN %s',
+
+    'validuntil-type': 'SELECT data_type '
+                            'FROM information_schema.columns '
+                       'WHERE table_name=\'nodes\' AND column_name=\'validuntil\'',
+
     'inner-nodes-for-job': 'SELECT jtn.nodeid '
                             'FROM jobstonodes AS jtn '
                             'INNER JOIN jobs AS j '
@@ -103,29 +217,145 @@ INSERTS = {
     'new-job': 'INSERT INTO jobs(jobID, status, started) '
                     'VALUES (%s, %s, now())',
 
-    'new-node': 'INSERT '
-                'INTO nodes(uuid, timemstmp, showlikelihood, hidelikelihood, recommended, classifiedby) '
-                    'VALUES(%s, %s, %s, %s, %s, %s)',
-
     'node-to-job-rel': 'INSERT '
                        'INTO jobstonodes(jobid, nodeid) '
-                            'VALUES(%s, %s)'
+                            'VALUES(%s, %s)',
+
+    # Inserts the results of many nodes, or updates them if a node is already
+    # cached, and links the nodes to the job - all in a single statement. Every
+    # row holds the inner id of the job and the results of one node.
+    'upsert-nodes-for-job': 'WITH v(jobid, uuid, timemstmp, showlikelihood, hidelikelihood, '
+                                   'recommended, classifiedby, validuntil) AS ('
+                                'VALUES %s'
+                            '), node AS ('
+                                'INSERT '
+                                'INTO nodes(uuid, timemstmp, showlikelihood, hidelikelihood, recommended, classifiedby, validuntil) '
+                                    'SELECT uuid, timemstmp, showlikelihood, hidelikelihood, recommended, classifiedby, validuntil '
+                                    'FROM v '
+                                'ON CONFLICT (uuid, timemstmp) DO UPDATE '
+                                    'SET showlikelihood=EXCLUDED.showlikelihood, '
+                                        'hidelikelihood=EXCLUDED.hidelikelihood, '
+                                        'recommended=EXCLUDED.recommended, '
+                                        'classifiedby=EXCLUDED.classifiedby, '
+                                        'validuntil=EXCLUDED.validuntil '
+                                'RETURNING nodes.id, nodes.uuid, nodes.timemstmp'
+                            ') '
+                            'INSERT '
+                            'INTO jobstonodes(jobid, nodeid) '
+                                'SELECT v.jobid, node.id '
+                                    'FROM node '
+                                    'INNER JOIN v ON v.uuid=node.uuid AND v.timemstmp=node.timemstmp '
+                            'ON CONFLICT (jobid, nodeid) DO NOTHING',
+
+    # Same as above, but keeps the results of the nodes that are still validly
+    # cached. The results of the expired ones are replaced, along with their
+    # validUntil. The update always happens, so that RETURNING gives back the
+    # ids of the existing rows.
+    'insert-nodes-for-job': 'WITH v(jobid, uuid, timemstmp, showlikelihood, hidelikelihood, '
+                                   'recommended, classifiedby, validuntil) AS ('
+                                'VALUES %s'
+                            '), node AS ('
+                                'INSERT '
+                                'INTO nodes(uuid, timemstmp, showlikelihood, hidelikelihood, recommended, classifiedby, validuntil) '
+                                    'SELECT uuid, timemstmp, showlikelihood, hidelikelihood, recommended, classifiedby, validuntil '
+                                    'FROM v '
+                                'ON CONFLICT (uuid, timemstmp) DO UPDATE '
+                                    'SET showlikelihood=CASE WHEN nodes.validuntil > now() '
+                                            'THEN nodes.showlikelihood ELSE EXCLUDED.showlikelihood END, '
+                                        'hidelikelihood=CASE WHEN nodes.validuntil > now() '
+                                            'THEN nodes.hidelikelihood ELSE EXCLUDED.hidelikelihood END, '
+                                        'recommended=CASE WHEN nodes.validuntil > now() '
+                                            'THEN nodes.recommended ELSE EXCLUDED.recommended END, '
+                                        'classifiedby=CASE WHEN nodes.validuntil > now() '
+                                            'THEN nodes.classifiedby ELSE EXCLUDED.classifiedby END, '
+                                        'validuntil=CASE WHEN nodes.validuntil > now() '
+                                            'THEN nodes.validuntil ELSE EXCLUDED.validuntil END '
+                                'RETURNING nodes.id, nodes.uuid, nodes.timemstmp'
+                            ') '
+                            'INSERT '
+                            'INTO jobstonodes(jobid, nodeid) '
+                                'SELECT v.jobid, node.id '
+                                    'FROM node '
+                                    'INNER JOIN v ON v.uuid=node.uuid AND v.timemstmp=node.timemstmp '
+                            'ON CONFLICT (jobid, nodeid) DO NOTHING',
+
+    'feature-vectors': 'INSERT '
+                       'INTO features(uuid, timemstmp, vector) '
+                            'VALUES %s '
+                       'ON CONFLICT (uuid, timemstmp) DO UPDATE '
+                            'SET vector=EXCLUDED.vector',
+
+    # Links the nodes that are still validly cached to a job, and returns them. The
+    # nodes are locked until the end of the transaction, so that the sweeper skips them.
+    'link-cached-nodes': 'WITH found AS ('
+                            'SELECT v.jobid, n.id, n.uuid, n.timemstmp '
+                                'FROM (VALUES %s) AS v(jobid, uuid, timemstmp) '
+                                'INNER JOIN nodes AS n ON n.uuid=v.uuid AND n.timemstmp=v.timemstmp '
+                            'WHERE n.validuntil > now() '
+                            'FOR SHARE OF n'
+                         '), linked AS ('
+                            'INSERT '
+                            'INTO jobstonodes(jobid, nodeid) '
+                                'SELECT jobid, id FROM found '
+                            'ON CONFLICT (jobid, nodeid) DO NOTHING'
+                         ') '
+                         'SELECT uuid, timemstmp FROM found'
+}
+
+# Row templates for the queries above that take many rows at once
+TEMPLATES = {
+    'node-results-for-job': "(%s::int, %s, %s::bigint, %s::float, %s::float, %s, %s, now() + %s * interval '1 second')",
+
+    'node-for-job': '(%s::int, %s, %s::bigint)',
+
+    'node': '(%s, %s::bigint)',
+
+    'feature-vector': '(%s, %s::bigint, %s)'
 }
 
+VALUES_PAGE_SIZE = 1000  # How many rows are sent in a single multi-row statement
+
+STREAM_FETCH_SIZE = 1000  # How many rows a server-side cursor fetches at once
+
+JOB_EVENTS_CHANNEL = 'job_events'  # Channel the job updates are notified on, with the job ID as payload
+
+DEFAULT_TTL = 259200  # How many seconds a cached result is valid for, unless stated otherwise
+
+LRU_SIZE = 100000  # How many node results are kept in memory by a cache handler
+
+JOB_STATUS_LRU_SIZE = 10000  # How many statuses of finished jobs are kept in memory by a cache handler
+
 UPDATES = {
-    'job-status': "UPDATE jobs "
-                    "SET status='%s' "
-                  "WHERE jobid='%s'",
-
-    'node-results': 'UPDATE nodes '
-                        'SET showlikelihood=%f, '
-                            'hidelikelihood=%f, '
-                            "recommended='%s' "
-                    "WHERE uuid='%s' AND timemstmp=%s"
+    'job-status': 'UPDATE jobs '
+                    'SET status=%s '
+                  'WHERE jobid=%s',
+
+    # Only moves the job to the new status from one of the given ones,
+    # so that a stopped job is never overwritten by the worker running it
+    'job-status-from': 'UPDATE jobs '
+                        'SET status=%s, '
+                            'stopped=CASE WHEN %s IN (\'STOPPED\', \'DONE\') THEN now() ELSE stopped END '
+                       'WHERE jobid=%s AND status = ANY(%s)'
+}
+
+DELETES = {
+    # At most %s expired nodes at a time, skipping the ones locked by
+    # concurrent writers. Their relations to jobs are removed by cascade.
+    'expired-nodes': 'DELETE FROM nodes '
+                     'WHERE id IN ('
+                        'SELECT id FROM nodes '
+                        'WHERE validuntil < now() '
+                        'LIMIT %s '
+                        'FOR UPDATE SKIP LOCKED'
+                     ')'
 }
 
 DELETE_CUSTOM = 'DELETE FROM %s'
 
 ACCEPTED_JOB_STATUS = ['WAITING', 'RUNNING', 'STOPPED', 'DONE']
 
+FINAL_JOB_STATUS = ['STOPPED', 'DONE']  # A job never leaves these, so their lookups can be kept in memory
+
+# The tables emptied when the cache is cleared. The feature vectors don't
+# depend on the model, so they are kept.
 TABLES = ['jobs', 'nodes', 'jobstonodes']
@@ -19,20 +19,29 @@ limitations under the License.
 
 """
 import psycopg2 as driver
+from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_values
+from contextlib import contextmanager
 from server.cache.constants import *
 from exceptions.server.cache import *
+import threading
+import os
 
 
 class PostgresDriver(object):
     """
-        Wrapper class handling PostgreSQL interaction
+        Wrapper class handling PostgreSQL interaction. All the queries are run
+        on connections borrowed from a thread-safe connection pool.
     """
     def __init__(self,
                  host,
                  port,
                  dbName,
                  user,
-                 password):
+                 password,
+                 minConn: int=1,
+                 maxConn: int=10):
         """
 
         :param host:            The host to connect to
@@ -40,39 +49,188 @@ class PostgresDriver(object):
         :param dbName:          The name of the database to connect to
         :param user:            The username to connect with
         :param password:        The password to connect with
+        :param minConn:         The number of connections the pool keeps open. Default 1.
+        :param maxConn:         The maximum number of connections the pool opens.
+                                Threads asking for more wait for one to be returned. Default 10.
         """
-
-        try:
-            self.conn = driver.connect(
-                host=host,
-                database=dbName,
-                user=user,
-                password=password,
-                port=port
-            )
-            self.conn.autocommit = True
-
-        except driver.OperationalError or driver.DatabaseError:
-            raise PostgresDriverConnectionException(
-                url="%s:%d" % (host, port),
-                dbName=dbName
-            )
+        assert 0 < minConn <= maxConn
 
         self.host = host
         self.port = port
         self.dbName = dbName
         self.user = user
         self.password = password
+        self.minConn = minConn
+        self.maxConn = maxConn
+
+        # Pools inherited from a parent process. Their connections belong to
+        # the parent, so they must neither be used nor closed in this process.
+        self._inheritedPools = list()
+
+        # Guards the current pool and its semaphore, which are always replaced together
+        self._lock = threading.RLock()
+        # Number of connections currently borrowed from every pool of this process
+        self._borrowed = dict()
+        # Replaced pools that still have borrowed connections. Each one is
+        # closed when its last connection is returned.
+        self._retiredPools = list()
+
+        self.pool = None
+        self._create_pool()
+
+    def _create_pool(self):
+        """
+            Private method that opens a new connection pool for the current process
+
+        :return:    -
+        :raises PostgresDriverConnectionException:      If connecting to the database fails
+        """
+        try:
+            pool = ThreadedConnectionPool(
+                self.minConn,
+                self.maxConn,
+                host=self.host,
+                database=self.dbName,
+                user=self.user,
+                password=self.password,
+                port=self.port
+            )
+        except (driver.OperationalError, driver.DatabaseError):
+            raise PostgresDriverConnectionException(
+                url="%s:%d" % (self.host, self.port),
+                dbName=self.dbName
+            )
+
+        with self._lock:
+            self.pool = pool
+            self._pid = os.getpid()
+            self._available = threading.BoundedSemaphore(self.maxConn)
+
+    def _get_pool(self):
+        """
+            Private method that returns the connection pool of the current process.
+            A process forked after the pool was created gets a pool of its own.
+            Has to be called with the lock held.
+
+        :return:    The pool
+        :raises PostgressNoActiveConnection:            If the driver was closed
+        """
+        if self.pool is None:
+            raise PostgressNoActiveConnection()
+
+        if self._pid != os.getpid():
+            # The pools of the parent process are never closed by this one
+            self._inheritedPools += [self.pool] + self._retiredPools
+            self._retiredPools = list()
+            self._borrowed = dict()
+            self._create_pool()
+
+        return self.pool
+
+    def _checkout_pool(self):
+        """
+            Private method that returns the current pool and its semaphore, and
+            counts one more connection borrowed from that pool. The connection has
+            to be returned to that same pool, through _checkin_pool(), even if the
+            driver switches to a new pool in the meantime.
+
+        :return:    The (pool, semaphore, ) pair
+        :raises PostgressNoActiveConnection:            If the driver was closed
+        """
+        with self._lock:
+            pool = self._get_pool()
+            self._borrowed[pool] = self._borrowed.get(pool, 0) + 1
+
+            return pool, self._available
+
+    def _checkin_pool(self,
+                      pool):
+        """
+            Private method that counts one connection returned to a pool,
+            closing the pool if it was retired and this was its last connection
+
+        :param pool:    The pool the connection was borrowed from
+        :return:        -
+        """
+        with self._lock:
+            self._borrowed[pool] -= 1
+
+            if self._borrowed[pool] != 0:
+                return
+
+            del self._borrowed[pool]
+
+            if pool in self._retiredPools:
+                self._retiredPools.remove(pool)
+                pool.closeall()
+
+    def _retire_pool(self,
+                     pool):
+        """
+            Private method that closes a pool of the current process which was
+            replaced, as soon as none of its connections is borrowed anymore
+
+        :param pool:    The pool to close
+        :return:        -
+        """
+        with self._lock:
+            if self._borrowed.get(pool, 0) == 0:
+                pool.closeall()
+            else:
+                self._retiredPools.append(pool)
+
+    @contextmanager
+    def _connection(self):
+        """
+            Private context manager that borrows a healthy connection from the pool
+            and returns it at the end of the 'with' block. Connections that turn
+            out to be broken are discarded rather than returned to the pool.
+
+        :return:    The connection, in autocommit mode
+        """
+        pool, available = self._checkout_pool()
+
+        try:
+            available.acquire()
+            try:
+                conn = pool.getconn()
+
+                # Health check
+                while conn.closed:
+                    pool.putconn(conn, close=True)
+                    conn = pool.getconn()
+
+                conn.autocommit = True
+
+                try:
+                    yield conn
+                except (driver.OperationalError, driver.InterfaceError):
+                    pool.putconn(conn, close=True)
+                    raise
+                except:
+                    if not conn.closed:
+                        conn.rollback()
+                    pool.putconn(conn, close=bool(conn.closed))
+                    raise
+                else:
+                    pool.putconn(conn)
+            finally:
+                available.release()
+        finally:
+            self._checkin_pool(pool)
 
     def close(self):
         """
-            Method that closes the database connection
+            Method that closes all the database connections. The ones still
+            borrowed are closed when they are returned.
 
         :return:    -
         """
-        if self.conn is not None:
-            self.conn.close()
-            self.conn = None
+        with self._lock:
+            if self.pool is not None:
+                if self._pid == os.getpid():
+                    self._retire_pool(self.pool)
+                self.pool = None
 
     def _execute_query(self,
                        query,
@@ -84,56 +242,138 @@ class PostgresDriver(object):
         :return:                                -
         :except psycopg2.DatabaseError:         If executing the query fails
         """
-        with self.conn.cursor() as cur:
-            print(cur)
-            cur.execute(query, *args)
-            cur.close()
-            self.conn.commit()
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, *args)
 
-    def _get_new_connection(self,
-                            newHost: str,
-                            newPort: str,
-                            newDbName: str,
-                            newUser: str,
-                            newPass: str):
+    def setup_database(self):
         """
 
-        :param newURL:          The new URL
-        :param newDbName:       The new db name
-        :param newUser:         The new username
-        :param newPass:         The new password
-        :return:                The new connection - if successful
-                                None               - otherwise
+            Method that creates the necessary tables for the
+            cache database to run.
+
+        :return:
         """
+        for table in DATABASE_SETUP:
 
-        try:
-            newConn = driver.connect(
-                host=newHost,
-                dbName=newDbName,
-                user=newUser,
-                password=newPass,
-                port=newPort
-            )
+            self._execute_query(DATABASE_SETUP[table])
+            print("Created the %s table" % table)
 
-            return newConn
-        except:
-            # If an exception is thrown while
-            # configuring the new connection,
-            # it is unsuccessful. Thus return None
-            return None
+        self.create_indexes()
 
-    def setup_database(self):
+    def create_indexes(self):
         """
+            Method that creates the indexes the cache database
+            needs, if they don't exist already
 
-            Method that creates the necessary tables for the
-            cache database to run.
+        :return:
+        """
+        for index in DATABASE_INDEXES:
+
+            self._execute_query(DATABASE_INDEXES[index])
+            print("Created the %s index" % index)
+
+    def migrate_database(self):
+        """
+            Method that brings an existing cache database up to date: creates
+            the missing tables, removes the duplicate entries the unique indexes
+            don't allow and then creates the indexes.
 
         :return:
         """
         for table in DATABASE_SETUP:
-
             self._execute_query(DATABASE_SETUP[table])
-            print("Created the %s table" % table)
+
+        with self.transaction() as cursor:
+            for statement in DATABASE_MIGRATIONS:
+                cursor.execute(statement)
+
+        print("Removed the duplicate cache entries")
+
+        self.create_indexes()
+
+    def is_up_to_date(self):
+        """
+            Method that checks whether the cache database has all the indexes
+            and column types the cache relies on
+
+        :return:    True - if it does
+                    False - if it needs migrating, or if the check fails
+        """
+        indexes = self.execute_SELECT(SELECTS['existing-indexes'], tuple(DATABASE_INDEXES))
+        validUntilType = self.execute_SELECT(SELECTS['validuntil-type'])
+
+        if indexes is None or validUntilType is None or len(validUntilType) == 0:
+            return False
+
+        return indexes[0][0] == len(DATABASE_INDEXES) and \
+            validUntilType[0][0].startswith('timestamp')
+
+    def prepare_database(self):
+        """
+            Method that makes sure the cache database is ready to be used, creating
+            or migrating it if needed. Has to be called before any job is accepted,
+            as caching the results relies on the unique indexes.
+
+        :return:
+        :except psycopg2.Error:         If the database can't be migrated
+        """
+        if not self.is_up_to_date():
+            self.migrate_database()
+
+    @contextmanager
+    def transaction(self):
+        """
+                Context manager that runs everything executed through the cursor
+                it provides in one transaction, which is committed at the end of the
+                'with' block or rolled back if the block raises:
+
+                    with driver.transaction() as cursor:
+                        cursor.execute(...)
+
+        :return:            The cursor
+        """
+        with self._connection() as conn:
+            conn.autocommit = False
+
+            with conn.cursor() as cur:
+                yield cur
+            conn.commit()
+
+    def execute_VALUES(self,
+                       query,
+                       rows: list,
+                       template: str=None,
+                       cursor=None,
+                       fetch: bool=False):
+        """
+                Method that executes a query for many rows at once. The query has to
+                contain a single VALUES %s wildcard, which is replaced with the rows.
+
+        :param query:       The query to be executed
+        :param rows:        The rows, as a list of tuples
+        :param template:    The template of a single row, e.g. '(%s, %s::bigint)'.
+                            Default None.
+        :param cursor:      The cursor to execute the query with, e.g. one provided by
+                            transaction(). Default None, i.e. the query runs in its own
+                            transaction.
+        :param fetch:       Whether to return the rows returned by the query or not.
+                            Default False.
+        :return:            The rows returned by the query - if fetch is True
+                            None - otherwise
+        """
+        if cursor is None:
+            with self.transaction() as cur:
+                return self.execute_VALUES(query, rows, template, cur, fetch)
+
+        return execute_values(
+            cursor,
+            query,
+            rows,
+            template=template,
+            page_size=VALUES_PAGE_SIZE,
+            fetch=fetch
+        )
 
     def execute_SELECT(self,
                        query,
@@ -148,15 +388,64 @@ class PostgresDriver(object):
 
         results = None
         try:
-            with self.conn.cursor() as cur:
-                cur.execute(query, args)
-                results = cur.fetchall()
-                cur.close()
-        except:
-            self.reset_connection()
+            with self._connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(query, args)
+                    results = cur.fetchall()
+        except driver.Error:
+            pass
 
         return results
 
+    def open_listener(self,
+                      channel: str):
+        """
+                Method that opens a dedicated connection, outside of the pool,
+                listening to the notifications sent on a channel. The caller
+                has to close it.
+
+        :param channel:     The name of the channel
+        :return:            The connection
+        :except psycopg2.Error:     If connecting to the database fails
+        """
+        conn = driver.connect(
+            host=self.host,
+            database=self.dbName,
+            user=self.user,
+            password=self.password,
+            port=self.port
+        )
+        conn.autocommit = True
+
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL('LISTEN {}').format(sql.Identifier(channel)))
+
+        return conn
+
+    def stream_SELECT(self,
+                      query,
+                      *args):
+        """
+                Generator running a SELECT query through a server-side cursor, so
+                that only STREAM_FETCH_SIZE rows at a time are held in memory. The
+                connection is kept until the generator is exhausted or closed.
+
+        :param query:       The query to be executed
+        :param args:        The arguments to replace the wildcards in the query
+        :return:            The query results, one tuple at a time
+        """
+        with self._connection() as conn:
+            # Server-side cursors only exist inside a transaction
+            conn.autocommit = False
+
+            with conn.cursor(name='stream_%d' % id(conn)) as cur:
+                cur.itersize = STREAM_FETCH_SIZE
+                cur.execute(query, args)
+
+                for row in cur:
+                    yield row
+
+            conn.commit()
 
     def execute_INSERT(self,
                        query,
@@ -169,12 +458,11 @@ class PostgresDriver(object):
         :return:           -
         """
         try:
-            with self.conn.cursor() as cur:
-                cur.execute(query, args)
-                cur.close()
-            self.conn.commit()
-        except:
-            self.reset_connection()
+            with self._connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(query, args)
+        except driver.Error:
+            pass
 
     def execute_UPDATE(self,
                        query,
@@ -185,19 +473,12 @@ class PostgresDriver(object):
 
         :param query:       The query to be executed
         :param args:        Other potential arguments for running the query
-        :return:            -
+        :return:            The number of updated rows
         """
-
-        self.reset_connection()
-
-        cursor = self.conn.cursor()
-
-        full_query = query % args
-
-        cursor.execute(full_query)
-
-        self.conn.commit()
-        cursor.close()
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, args)
+                return cur.rowcount
 
     def renew_connection(self,
                          newHost: str,
@@ -219,33 +500,49 @@ class PostgresDriver(object):
         :return:                True - if successful
                                 False - otherwise
         """
-        url = "%s:%d" % (newHost, newPort)
+        with self._lock:
+            oldSettings = (self.host, self.port, self.dbName, self.user, self.password, )
+            oldPool = self.pool
+            oldPoolIsOwn = self._pid == os.getpid()
+
+            self.host, self.port, self.dbName, self.user, self.password = \
+                newHost, newPort, newDbName, newUser, newPass
+
+            try:
+                # Only replaces the pool if successful
+                self._create_pool()
+            except PostgresDriverConnectionException:
+                self.host, self.port, self.dbName, self.user, self.password = oldSettings
+                return False
+
+            if oldPool is not None:
+                if oldPoolIsOwn:
+                    # Threads may still be using its connections
+                    self._retire_pool(oldPool)
+                else:
+                    self._inheritedPools.append(oldPool)
 
-        newConn = self._get_new_connection(url, newDbName, newUser, newPass)
-
-        if newConn is None:
-            return False
-
-        self.url = url
-        self.dbName = newDbName
-        self.user = newUser
-        self.password = newPass
-
-        self.conn = newConn
-
-        return True
+            return True
 
     def reset_connection(self):
         """
-            Method that attempts to reset the
-            current connection. Only changes
-            the actual inner object if
-            the new connection is successful
+            Method that checks the health of the connection pool and,
+            if it can't provide a working connection anymore, replaces it
+            with a new one. Only changes the actual inner pool if the
+            new one is successful
 
         :return:        True - if successful
                         False - otherwise
         """
-        newConn = self._get_new_connection(
+        try:
+            with self._connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+            return True
+        except (driver.Error, PostgressNoActiveConnection):
+            pass
+
+        return self.renew_connection(
             newHost=self.host,
             newPort=self.port,
             newDbName=self.dbName,
@@ -253,12 +550,6 @@ class PostgresDriver(object):
             newPass=self.password
         )
 
-        if newConn is None:
-            return False
-        else:
-            self.conn = newConn
-            return True
-
     def __exit__(self,
                  exc_type,
                  exc_val,
@@ -282,12 +573,9 @@ class PostgresDriver(object):
         :param query:       The query to be run
         :param args:        Any additional arguments required for the query
 
-        :return:            -
+        :return:            The number of deleted rows
         """
-
-        cursor = self.conn.cursor()
-
-        cursor.execute(query, args)
-
-        self.conn.commit()
-        cursor.close()
+        with self._connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, args)
+                return cur.rowcount
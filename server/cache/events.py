@@ -0,0 +1,195 @@
+"""
+Part2Project -- events.py
+
+Copyright Apr 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from collections import OrderedDict
+import threading
+import select
+
+import psycopg2 as driver
+
+from server.cache.driver import PostgresDriver
+from server.cache.constants import JOB_EVENTS_CHANNEL
+
+
+class JobEventBus(object):
+    """
+        In-process bus the request threads wait on for a job to change,
+        i.e. for its status to change or for new results to be cached.
+        Every job has a version, incremented by each of its events.
+    """
+    def __init__(self,
+                 maxJobs: int=10000):
+        """
+            CONSTRUCTOR
+
+        :param maxJobs:         The maximum number of jobs whose version is kept.
+                                The least recently updated ones are forgotten first.
+        """
+        assert maxJobs > 0
+
+        self.maxJobs = maxJobs
+
+        self._versions = OrderedDict()
+        # Incremented when events may have been missed, waking every waiter
+        self._generation = 0
+        self._condition = threading.Condition()
+
+    def _current(self,
+                 jobID: str):
+        return self._generation, self._versions.get(jobID, 0)
+
+    def version(self,
+                jobID: str):
+        """
+
+        :param jobID:           The public ID of the job
+        :return:                The current version of the job, to pass to wait()
+        """
+        with self._condition:
+            return self._current(jobID)
+
+    def publish(self,
+                jobID: str):
+        """
+            Method that signals that a job changed
+
+        :param jobID:           The public ID of the job
+        :return:                -
+        """
+        with self._condition:
+            self._versions[jobID] = self._versions.get(jobID, 0) + 1
+            self._versions.move_to_end(jobID)
+
+            if len(self._versions) > self.maxJobs:
+                self._versions.popitem(last=False)
+
+            self._condition.notify_all()
+
+    def publish_all(self):
+        """
+            Method that signals that any job may have changed
+
+        :return:                -
+        """
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    def wait(self,
+             jobID: str,
+             version,
+             timeout: float) -> bool:
+        """
+            Method that blocks until the job changes after the given version,
+            or until the timeout expires
+
+        :param jobID:           The public ID of the job
+        :param version:         The version of the job, as returned by version()
+        :param timeout:         Maximum number of seconds to wait
+
+        :return:                True - if the job changed
+                                False - if the timeout expired
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._current(jobID) != version,
+                timeout
+            )
+
+
+class JobEventListener(threading.Thread):
+    """
+        Background thread listening to the job events sent by the workers
+        through the cache database (LISTEN/ NOTIFY), and publishing them on
+        the in-process bus
+    """
+    def __init__(self,
+                 bus: JobEventBus,
+                 postgresDriver: PostgresDriver,
+                 pollInterval: float=1,
+                 reconnectDelay: float=5):
+        """
+            CONSTRUCTOR
+
+        :param bus:                 The bus to publish the events on
+        :param postgresDriver:      The driver of the cache database
+        :param pollInterval:        Maximum number of seconds to wait for an event before
+                                    checking whether the listener was stopped. Default 1.
+        :param reconnectDelay:      Number of seconds to wait before connecting again,
+                                    if the connection is lost. Default 5.
+        """
+        super(JobEventListener, self).__init__(name='job-event-listener')
+        self.daemon = True
+
+        self.bus = bus
+        self.postgresDriver = postgresDriver
+        self.pollInterval = pollInterval
+        self.reconnectDelay = reconnectDelay
+
+        self._stopped = threading.Event()
+
+    def _listen(self,
+                conn):
+        """
+            Private method that publishes the events received on a connection,
+            until the listener is stopped
+
+        :param conn:        The listening connection
+        :return:            -
+        """
+        while not self._stopped.is_set():
+            if select.select([conn], [], [], self.pollInterval) == ([], [], []):
+                continue
+
+            conn.poll()
+
+            while conn.notifies:
+                self.bus.publish(conn.notifies.pop(0).payload)
+
+    def run(self):
+        """
+            Main loop of the listener
+
+        :return:        -
+        """
+        while not self._stopped.is_set():
+            try:
+                conn = self.postgresDriver.open_listener(JOB_EVENTS_CHANNEL)
+            except driver.Error:
+                self._stopped.wait(self.reconnectDelay)
+                continue
+
+            try:
+                # Events sent while not listening are lost,
+                # so every waiting request has to check its job again
+                self.bus.publish_all()
+
+                self._listen(conn)
+            except (driver.Error, OSError, ValueError):
+                # The connection was lost
+                pass
+            finally:
+                conn.close()
+
+    def stop(self):
+        """
+            Method that stops the listener, within pollInterval seconds
+
+        :return:        -
+        """
+        self._stopped.set()
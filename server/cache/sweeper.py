@@ -0,0 +1,95 @@
+"""
+Part2Project -- sweeper.py
+
+Copyright Apr 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+import threading
+
+from server.cache import CacheHandler
+
+
+class CacheSweeper(threading.Thread):
+    """
+        Background thread that periodically removes the expired entries from
+        the cache. The entries are removed in small batches, each in its own
+        short transaction, so the cache stays available while it is swept.
+    """
+    def __init__(self,
+                 cacheHandler: CacheHandler,
+                 interval: float=600,
+                 batchSize: int=1000,
+                 pause: float=0.1):
+        """
+            CONSTRUCTOR
+
+        :param cacheHandler:        The handler of the cache to sweep
+        :param interval:            Number of seconds between two sweeps. Default 600.
+        :param batchSize:           Maximum number of entries removed at once. Default 1000.
+        :param pause:               Number of seconds to wait between two batches of
+                                    the same sweep. Default 0.1.
+        """
+        assert interval > 0 and batchSize > 0
+
+        super(CacheSweeper, self).__init__(name='cache-sweeper')
+        self.daemon = True
+
+        self.cacheHandler = cacheHandler
+        self.interval = interval
+        self.batchSize = batchSize
+        self.pause = pause
+
+        self._stopped = threading.Event()
+
+    def sweep(self):
+        """
+            Method that removes all the entries expired so far, one batch at a time
+
+        :return:        The number of entries removed
+        """
+        removed = 0
+
+        while not self._stopped.is_set():
+            deleted = self.cacheHandler.delete_expired(self.batchSize)
+
+            if deleted is None:
+                # The cache database is unavailable, try again at the next sweep
+                break
+
+            removed += deleted
+
+            if deleted < self.batchSize:
+                break
+
+            self._stopped.wait(self.pause)
+
+        return removed
+
+    def run(self):
+        """
+            Main loop of the sweeper
+
+        :return:        -
+        """
+        while not self._stopped.wait(self.interval):
+            self.sweep()
+
+    def stop(self):
+        """
+            Method that stops the sweeper, at the latest after the current batch
+
+        :return:        -
+        """
+        self._stopped.set()
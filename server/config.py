@@ -12,19 +12,34 @@ class Config(object):
 
     TTL = 259200
 
+    CACHE_SWEEP = {
+        'interval': 600,    # Seconds between two sweeps of the expired cache entries
+        'batchSize': 1000,  # Expired entries removed in a single transaction
+        'pause': 0.1        # Seconds between two batches of the same sweep
+    }
+
+    MAX_CONCURRENT_JOBS = os.cpu_count() or 1  # Number of jobs (and inference workers) running at once
+    MAX_WAITING_JOBS = 100  # Number of jobs that can wait for a worker before new ones are refused
+    JOB_BATCH_SIZE = 1000  # Number of nodes of a job classified and cached at once
+
     CACHE_CONN_DATA = {
         'host': '127.0.0.1',
         'port': 5432,
         'user': 'tma33',
         'password': 'password',
-        'dbName': 'server-cache'
+        'dbName': 'server-cache',
+        'minConn': 1,
+        'maxConn': 10,
+        'lruSize': 100000,  # Node results kept in memory by every inference worker, in front of the database
+        'statusLRUSize': 10000  # Statuses of finished jobs kept in memory by every process, in front of the database
     }
 
     NEO4J_CONN_DATA = {
         'host': 'bolt://127.0.0.1',
         'port': 7687,
         'user': 'neo4j',
-        'password': 'opus'
+        'password': 'opus',
+        'maxPoolSize': 50
     }
 
     MODEL = {
@@ -44,6 +59,10 @@ class Config(object):
         {
             'url': '/job-action',
             'class': JobActionView
+        },
+        {
+            'url': '/job-wait',
+            'class': JobWaitView
         }
     ]
 
@@ -19,18 +19,24 @@ limitations under the License.
 from models.model import Model
 from models import get_model
 from models.config import PredictConfig
-from data.features import get_dataset, build_df_from_list, get_node_type, get_closest_process, get_df_from_list
-from data.features.constants import FEATURES_ONE_HOT
+from data.features import get_dataset, get_node_type, get_closest_process, build_feature_matrix
+from data.features.memo import ExtractionMemo
+from data.features.constants import EXTRACTION_MEMO_SIZE
 from data.neo4J.database_driver import AnotherDatabaseDriver
 from server.cache import CacheHandler
+from exceptions.server import JobResultsNotCached
 from datetime import datetime as dt
 from server.utils import CLASSIFIABLE_NODES, UNCLASSIFIABLE_NODES
 import random
 import base64
 import numpy as np
 import json
-from multiprocessing import Process
+from multiprocessing import Process, Queue, Value
 from server import utils
+import logging
+
+logger = logging.getLogger(__name__)
+
 
 class RequestJob(object):
     """
@@ -53,11 +59,13 @@ class RequestJob(object):
         :param feature_extractor:
         :param jobID:
         :param ttl:
+        :param batch_size:      How many nodes are classified and cached at once
         """
+        assert batch_size > 0
+
         self.nodes = nodes
         self.model = model
         self.cacheHandler = cache_handler
-        self.cacheHandler.postgresDriver.reset_connection()
         self.neo4jDriver = driver
         self.jobID = jobID
         self.ttl = ttl
@@ -66,16 +74,24 @@ class RequestJob(object):
 
         self.assoc = list()
         self.to_extract = list()
+        self.to_classify = list()
         self.cached = list()
 
-    def _preprocess_on_type(self):
+        # The memo of the extraction sub-queries, shared by all the batches
+        # of the job while it runs, and its stats once it finished
+        self.memo = None
+        self.memo_stats = None
+
+    def _preprocess_on_type(self,
+                            nodes: list):
         """
 
+        :param nodes:       The nodes to preprocess
         :return:
         """
         results = list()
 
-        for node in self.nodes:
+        for node in nodes:
 
             if node['uuid'] is None or node['timestamp'] is None:
                 continue
@@ -133,32 +149,62 @@ class RequestJob(object):
 
     def _get_feature_vectors(self):
         """
+            Private method that gets the feature vectors of the nodes to classify.
+            The stored ones are reused, only the others are extracted from the
+            Neo4J database - and then stored for the next time.
 
-        :return:
+            The nodes with a feature vector are kept in self.to_classify, in the
+            order of the rows of the feature matrix.
+
+        :return:    The feature matrix and the results for the nodes without a feature vector
         """
-        raw_feature_vectors = get_dataset(
-            driver=self.neo4jDriver,
-            nodes=self.to_extract,
-            include_NONE=True
-        )
+        stored = utils.cacheHandler.get_feature_vectors(self.to_extract)
+
+        missing = [
+            node for node in self.to_extract
+            if (node['uuid'], node['timestamp'], ) not in stored
+        ]
+
+        vectors = dict(stored)
+
+        if len(missing) != 0:
+            raw_feature_vectors = get_dataset(
+                driver=self.neo4jDriver,
+                nodes=missing,
+                include_NONE=True,
+                memo=self.memo
+            )
+
+            utils.cacheHandler.add_feature_vectors(raw_feature_vectors)
+
+            for fv in raw_feature_vectors:
+                vectors[fv['id']] = fv['self']
 
         results = list()
         feature_vectors = list()
 
-        for fv in raw_feature_vectors:
-            if fv['self'] is None:
+        for node in self.to_extract:
+            id = (node['uuid'], node['timestamp'], )
+            vector = vectors.get(id)
+
+            if vector is None:
                 results.append({
-                    'uuid': fv['id'][0],
-                    'timestamp': fv['id'][1],
+                    'uuid': id[0],
+                    'timestamp': id[1],
                     'showProb': None,
                     'hideProb': None,
                     'recommended': None,
                     'classifiedBy': 'N/ A'
                 })
             else:
-                feature_vectors.append(fv)
+                feature_vectors.append({
+                    'id': id,
+                    'self': vector
+                })
+                self.to_classify.append(node)
 
-        feature_matrix = get_df_from_list(feature_vectors).as_matrix(columns=FEATURES_ONE_HOT)
+        # Single precision is all the model needs
+        feature_matrix = build_feature_matrix(feature_vectors, dtype=np.float32)
 
         return feature_matrix, results
 
@@ -174,7 +220,7 @@ class RequestJob(object):
         results = list()
 
         for i in range(len(probs)):
-            new_result = self.to_extract[i]
+            new_result = self.to_classify[i]
             new_result['showProb'] = probs[i, 0]
             new_result['hideProb'] = probs[i, 1]
             new_result['classifiedBy'] = self.model.name
@@ -188,100 +234,168 @@ class RequestJob(object):
 
         return results
 
-    def _look_for_cached_values(self):
+    def _look_for_cached_values(self,
+                                nodes: list):
         """
-
-        :return:
+            Private method that looks up all the nodes in the cache at once.
+            The cached ones are linked to the job right away and set aside in
+            self.cached, so that they skip the Neo4J database and the model
+            altogether. The ones that can't be linked, e.g. because their entry
+            was removed in the meantime, are classified again.
+
+        :param nodes:       The nodes of the job
+        :return:            The nodes that are not cached
+        :raises JobResultsNotCached:     If the cached nodes could not be linked to the job
         """
+        cached = utils.cacheHandler.get_cached_results(nodes)
 
-        for node in self.to_extract:
-            cache_valid = utils.cacheHandler.cache_valid(
-                uuid=node['uuid'],
-                timestamp=node['timestamp']
-            )
+        hits = [
+            node for node in nodes
+            if (node['uuid'], node['timestamp'], ) in cached
+        ]
+
+        linked = utils.cacheHandler.link_cached_nodes(
+            jobID=self.jobID,
+            nodes=hits
+        )
 
-            if cache_valid:
-                self.to_extract.pop(self.to_extract.index(node))
+        if linked is None:
+            raise JobResultsNotCached(self.jobID)
+
+        not_cached = list()
+
+        for node in nodes:
+            if (node['uuid'], node['timestamp'], ) in linked:
                 self.cached.append(node)
+            else:
+                not_cached.append(node)
+
+        return not_cached
 
     def _add_results_to_cache(self,
                               results: list):
         """
 
         :param results:         The list of results that need to be cached
-        :return:
+        :return:                True - if successful
+                                False - otherwise
         """
 
+        to_cache = list()
+
         for node in results:
-            utils.cacheHandler.add_node_results(
-                jobID=self.jobID,
-                uuid=node['uuid'],
-                timestamp=node['timestamp'],
-                showProb=float(node['showProb']) if node['showProb'] else None,
-                hideProb=float(node['hideProb']) if node['hideProb'] else None,
-                recommended=node['recommended'],
-                classifiedbY=node['classifiedBy']
-            )
+            to_cache.append({
+                'uuid': node['uuid'],
+                'timestamp': node['timestamp'],
+                'showProb': float(node['showProb']) if node['showProb'] else None,
+                'hideProb': float(node['hideProb']) if node['hideProb'] else None,
+                'recommended': node['recommended'],
+                'classifiedBy': node['classifiedBy']
+            })
+
+        by_id = dict(((node['uuid'], node['timestamp'], ), node) for node in to_cache)
 
         for entry in self.assoc:
-            node = results[results.index(entry['for_result'])]
-            utils.cacheHandler.add_node_results(
-                jobID=self.jobID,
-                uuid=entry['original']['uuid'],
-                timestamp=node['original']['timestamp'],
-                showProb=float(node['showProb']) if node['showProb'] else None,
-                hideProb=float(node['hideProb']) if node['hideProb'] else None,
-                recommended=node['recommended'],
-                classifiedbY=node['classifiedBy']
-            )
+            node = by_id.get((entry['for_result']['uuid'], entry['for_result']['timestamp'], ))
 
-    def _add_connections_for_cached_values(self):
-        """
+            if node is None:
+                continue
 
-        :return:
-        """
-        for node in self.cached:
+            new_entry = dict(node)
+            new_entry['uuid'] = entry['original']['uuid']
+            new_entry['timestamp'] = entry['original']['timestamp']
+            to_cache.append(new_entry)
 
-            utils.cacheHandler.add_node_to_job_rel(
-                uuid=node['uuid'],
-                timestamp=node['timestamp'],
-                jobID=self.jobID
-            )
+        return utils.cacheHandler.add_nodes_results(
+            jobID=self.jobID,
+            results=to_cache,
+            ttl=self.ttl
+        )
 
-    def run(self):
+    def _run_batch(self,
+                   nodes: list):
         """
+            Private method that classifies a batch of nodes and caches the results.
+            The results are visible to the clients as soon as it returns.
 
-        :return:    -
+        :param nodes:       The nodes in the batch
+        :return:            -
+        :raises JobResultsNotCached:     If the results of the batch could not be cached
         """
-        self.status = 'RUNNING'
-        utils.cacheHandler.update_job_status(
-            self.jobID,
-            self.status
-        )
+        self.assoc = list()
+        self.to_extract = list()
+        self.to_classify = list()
+        self.cached = list()
 
-        results = self._preprocess_on_type()
+        not_cached = self._look_for_cached_values(nodes)
 
-        self._look_for_cached_values()
+        results = self._preprocess_on_type(not_cached)
 
-        Xs, res = self._get_feature_vectors()
-        results += res
+        if len(self.to_extract) != 0:
+            Xs, res = self._get_feature_vectors()
+            results += res
 
+            if len(self.to_classify) != 0:
+                probs = self.model.predict_probs(
+                    data=Xs
+                )
 
-        probs = self.model.predict_probs(
-            data=Xs
-        )
+                res = self._process_probabilities(probs)
+                results += res
 
-        res = self._process_probabilities(probs)
-        results += res
+        if not self._add_results_to_cache(results=results):
+            raise JobResultsNotCached(self.jobID)
 
-        self._add_results_to_cache(results=results)
+        utils.cacheHandler.notify_job_update(self.jobID)
 
-        self._add_connections_for_cached_values()
+    def _stop_requested(self):
+        """
+            Private method that checks whether the job was stopped by a client
 
-        utils.cacheHandler.update_job_status(
-            jobID=self.jobID,
-            newStatus='DONE'
-        )
+        :return:    True - if the job was stopped
+                    False - otherwise
+        """
+        return utils.cacheHandler.get_job_status(self.jobID) == 'STOPPED'
+
+    def run(self):
+        """
+            Method that runs the job, self.batchSize nodes at a time. The job
+            can be stopped between two batches, keeping the results so far.
+
+            The batches share one memo of the extraction sub-queries, as the nodes
+            of a job are often connected to the same ones. Its stats are logged
+            and left in self.memo_stats when the job ends.
+
+        :return:    -
+        """
+        if not utils.cacheHandler.start_job(self.jobID):
+            # Stopped while it was waiting
+            self.status = 'STOPPED'
+            return
+
+        self.status = 'RUNNING'
+        self.memo = ExtractionMemo(EXTRACTION_MEMO_SIZE)
+
+        try:
+            for start in range(0, len(self.nodes), self.batchSize):
+                if self._stop_requested():
+                    self.status = 'STOPPED'
+                    return
+
+                self._run_batch(self.nodes[start:start + self.batchSize])
+        finally:
+            self.memo_stats = self.memo.stats()
+            self.memo = None
+
+            logger.info(
+                "Job %s memoised extraction sub-queries: %d hits, %d misses",
+                self.jobID, self.memo_stats['hits'], self.memo_stats['misses']
+            )
+
+        if utils.cacheHandler.mark_job_as_done(self.jobID):
+            self.status = 'DONE'
+        else:
+            self.status = 'STOPPED'
 
 
 def run_job(jobID: str,
@@ -289,7 +403,8 @@ def run_job(jobID: str,
             neo4JDriver: AnotherDatabaseDriver,
             nodes: list,
             cacheHandler: CacheHandler,
-            ttl: int):
+            ttl: int,
+            batchSize: int):
 
     job = RequestJob(
         nodes=nodes,
@@ -297,13 +412,185 @@ def run_job(jobID: str,
         cache_handler=cacheHandler,
         driver=neo4JDriver,
         jobID=jobID,
-        ttl=ttl if ttl else ttl,
-        batch_size=len(nodes)
+        ttl=ttl,
+        batch_size=batchSize
     )
 
     job.run()
 
 
+def _worker_loop(jobsQueue: Queue,
+                 cacheGeneration: Value,
+                 neo4jConnData: dict,
+                 cacheConnData: dict,
+                 modelData: dict,
+                 batchSize: int):
+    """
+            Main loop of an inference worker. The worker loads the model and
+            connects to the databases once, then keeps running the jobs it
+            receives through the queue, until it gets None.
+
+    :param jobsQueue:           The queue the jobs are received from, as (jobID, nodes, ttl, ) tuples
+    :param cacheGeneration:     Counter incremented every time the cache is cleared. The worker
+                                drops the results it keeps in memory when it changes.
+    :param neo4jConnData:       The connection data for the Neo4J database
+    :param cacheConnData:       The connection data for the cache database
+    :param modelData:           The name and checkpoint of the model to load
+    :param batchSize:           How many nodes of a job are classified and cached at once
+    :return:                    -
+    """
+    model = get_model(
+        name=modelData['name'],
+        config=PredictConfig,
+        checkpoint=modelData['checkpoint']
+    )
+
+    neo4jDriver = AnotherDatabaseDriver(
+        host=neo4jConnData['host'],
+        port=neo4jConnData['port'],
+        user=neo4jConnData['user'],
+        pswd=neo4jConnData['password'],
+        max_pool_size=neo4jConnData['maxPoolSize']
+    )
+
+    cacheHandler = CacheHandler(
+        user=cacheConnData['user'],
+        password=cacheConnData['password'],
+        host=cacheConnData['host'],
+        port=cacheConnData['port'],
+        dbName=cacheConnData['dbName'],
+        minConn=cacheConnData['minConn'],
+        maxConn=cacheConnData['maxConn'],
+        lruSize=cacheConnData['lruSize'],
+        statusLRUSize=cacheConnData['statusLRUSize']
+    )
+
+    # A handler inherited from the parent process shares the parent's connections,
+    # and garbage-collecting it would close them. It is kept, but never used.
+    inheritedCacheHandler = utils.cacheHandler
+
+    utils.model = model
+    utils.cacheHandler = cacheHandler
+
+    generation = cacheGeneration.value
+
+    while True:
+        job = jobsQueue.get()
+
+        if job is None:
+            break
+
+        if cacheGeneration.value != generation:
+            generation = cacheGeneration.value
+            cacheHandler.clear_lru()
+
+        jobID, nodes, ttl = job
+
+        try:
+            run_job(
+                jobID=jobID,
+                model=model,
+                neo4JDriver=neo4jDriver,
+                nodes=nodes,
+                cacheHandler=cacheHandler,
+                ttl=ttl,
+                batchSize=batchSize
+            )
+        except Exception:
+            # One failing job should not take the worker down with it
+            logger.exception("Job %s failed", jobID)
+
+            # Stopped, so that the clients don't wait for it forever
+            try:
+                cacheHandler.stop_job(jobID)
+            except Exception:
+                logger.exception("Failed to stop job %s", jobID)
+
+    neo4jDriver.close()
+
+
+class WorkerPool(object):
+    """
+        Class representing a pool of long-lived inference workers, each
+        holding its own copy of the model in memory
+    """
+    def __init__(self,
+                 size: int,
+                 neo4jConnData: dict,
+                 cacheConnData: dict,
+                 modelData: dict,
+                 batchSize: int):
+        """
+            CONSTRUCTOR
+
+        :param size:                The number of worker processes
+        :param neo4jConnData:       The connection data for the Neo4J database
+        :param cacheConnData:       The connection data for the cache database
+        :param modelData:           The name and checkpoint of the model the workers use
+        :param batchSize:           How many nodes of a job are classified and cached at once
+        """
+        assert size > 0 and batchSize > 0
+
+        self.size = size
+        self.jobsQueue = Queue()
+        self.cacheGeneration = Value('i', 0)
+        self.workers = list()
+
+        for _ in range(size):
+            worker = Process(
+                target=_worker_loop,
+                args=(self.jobsQueue,
+                      self.cacheGeneration,
+                      neo4jConnData,
+                      cacheConnData,
+                      modelData,
+                      batchSize)
+            )
+            worker.daemon = True
+            worker.start()
+
+            self.workers.append(worker)
+
+    def submit(self,
+               jobID: str,
+               nodes: list,
+               ttl: int):
+        """
+            Method that hands a job over to the first available worker.
+            Jobs are picked up by the workers in the order they were submitted.
+
+        :param jobID:       The ID of the job
+        :param nodes:       The nodes to classify
+        :param ttl:         The time-to-live of the results
+        :return:            -
+        """
+        self.jobsQueue.put((jobID, nodes, ttl, ))
+
+    def clear_caches(self):
+        """
+            Method that makes all the workers drop the results they keep in memory,
+            before they start their next job
+
+        :return:            -
+        """
+        with self.cacheGeneration.get_lock():
+            self.cacheGeneration.value += 1
+
+    def close(self):
+        """
+            Method that stops all the workers, after they finish their current job
+
+        :return:            -
+        """
+        for _ in self.workers:
+            self.jobsQueue.put(None)
+
+        for worker in self.workers:
+            worker.join()
+
+        self.workers = list()
+
+
 class JobsHandler(object):
     """
 
@@ -312,20 +599,39 @@ class JobsHandler(object):
                  neo4jConnData: dict,
                  cacheConnData: dict,
                  defaultTTL: int,
-                 defaultModel: dict):
+                 defaultModel: dict,
+                 maxConcurrentJobs: int=1,
+                 maxWaitingJobs: int=None,
+                 jobBatchSize: int=1000):
         """
+            Jobs are run in the order they were added, by at most maxConcurrentJobs
+            workers at a time. The others wait, with the 'WAITING' status, for a
+            worker to become available.
 
         :param neo4jConnData:
         :param cacheConnData:
         :param defaultTTL:
         :param defaultModel:
+        :param maxConcurrentJobs:   Maximum number of jobs running at the same time. Default 1.
+        :param maxWaitingJobs:      Maximum number of jobs waiting to be run. New jobs are refused
+                                    while this many are waiting. Default None, i.e. no limit.
+        :param jobBatchSize:        How many nodes of a job are classified and cached at once.
+                                    The results of a batch are available as soon as it is done.
+                                    Default 1000.
         """
         self.cacheConnData = cacheConnData
         self.defaultModel = defaultModel
         self.defaultTTL = defaultTTL
         self.neo4jConnData = neo4jConnData
-
-        self.processes = list()
+        self.maxWaitingJobs = maxWaitingJobs
+
+        self.pool = WorkerPool(
+            size=maxConcurrentJobs,
+            neo4jConnData=neo4jConnData,
+            cacheConnData=cacheConnData,
+            modelData=defaultModel,
+            batchSize=jobBatchSize
+        )
 
     def _generate_jobID(self,
                         nodesCount: int):
@@ -353,80 +659,43 @@ class JobsHandler(object):
 
     def add_job(self,
                 nodes: list,
-                ttl=None,
-                model=None,
-                cacheHandler=None,
-                neo4jDriver=None):
+                ttl=None):
         """
 
-        :param nodes:
-        :param ttl:
-        :param model:
-        :param cacheHandler:
-        :param neo4jDriver:
-        :return:
+        :param nodes:           The nodes to classify
+        :param ttl:             The time-to-live of the results. Default None, i.e.
+                                the default TTL of the handler
+        :return:                The ID of the new job - if successful
+                                None - if too many jobs are already waiting
         """
 
-        running_jobs = utils.cacheHandler.get_running_jobs()
+        if self.maxWaitingJobs is not None:
+            waiting_jobs = utils.cacheHandler.count_jobs_with_status('WAITING')
 
-        if len(running_jobs) > 0:
-            return None
+            if waiting_jobs is not None and waiting_jobs >= self.maxWaitingJobs:
+                return None
 
         newJobID = self._generate_jobID(len(nodes))[:20]
 
-        if cacheHandler is None:
-            cacheHandler = CacheHandler(
-                user=self.cacheConnData['user'],
-                password=self.cacheConnData['password'],
-                host=self.cacheConnData['host'],
-                port=self.cacheConnData['port'],
-                dbName=self.cacheConnData['dbName']
-            )
-
-        if neo4jDriver is None:
-            neo4jDriver = AnotherDatabaseDriver(
-                host=self.neo4jConnData['host'],
-                port=self.neo4jConnData['port'],
-                user=self.neo4jConnData['user'],
-                pswd=self.neo4jConnData['password']
-            )
-
-        if model is None:
-            model = get_model(
-                name=self.defaultModel['name'],
-                config=PredictConfig,
-                checkpoint=self.defaultModel['checkpoint']
-            )
-
-        cacheHandler.add_new_job(
+        utils.cacheHandler.add_new_job(
             jobID=newJobID,
             status='WAITING',
             startedAt=None
         )
 
-        utils.cacheHandler = CacheHandler(
-            user=self.cacheConnData['user'],
-            password=self.cacheConnData['password'],
-            host=self.cacheConnData['host'],
-            port=self.cacheConnData['port'],
-            dbName=self.cacheConnData['dbName']
-        )
-
-        newProcess = Process(
-            target=run_job,
-            args=(newJobID,
-                  model,
-                  neo4jDriver,
-                  nodes,
-                  cacheHandler,
-                  self.defaultTTL)
+        self.pool.submit(
+            jobID=newJobID,
+            nodes=nodes,
+            ttl=ttl if ttl else self.defaultTTL
         )
 
-        newProcess.daemon = True
-
-        newProcess.start()
-
-        self.processes.append(newProcess)
-
         return newJobID
 
+    def clear_caches(self):
+        """
+            Method that makes the workers drop the results they keep in memory.
+            Has to be called whenever the cache database is cleared.
+
+        :return:                -
+        """
+        self.pool.clear_caches()
@@ -18,6 +18,7 @@ limitations under the License.
 """
 jobsHandler = None
 cacheHandler = None
+jobEvents = None
 featureExtractor = None
 model = None
 
@@ -17,8 +17,9 @@ limitations under the License.
 
 """
 from flask.views import View
-from flask import request, Response, jsonify
+from flask import request, Response, jsonify, stream_with_context
 from server import utils
+import json
 from server.jobs import JobsHandler
 
 
@@ -121,8 +122,8 @@ class ClassifyView(View):
 
             if id is None:
                 return Response(
-                    status=500,
-                    response='Maximum number of running jobs achieved'
+                    status=503,
+                    response='Maximum number of waiting jobs achieved'
                 )
 
             response['status'] = 'Success'
@@ -147,7 +148,7 @@ class JobActionView(View):
             - returning job partial/ total results
             - stopping a job
 
-        Path: /job-action?id=<jobID>&action=<action>
+        Path: /job-action?id=<jobID>&action=<action>[&cursor=<cursor>][&limit=<limit>][&format=<format>]
         Methods: GET
 
         The action parameter will get one of the values: 'status', 'results', 'stop'
@@ -182,11 +183,30 @@ class JobActionView(View):
                         }
                     ]
                 }
+
+                The results can be paged by providing a limit (at most max_limit). The response then
+                also contains a 'nextCursor' entry, to pass as the cursor of the next request. It is
+                None on the last page.
+
+                With format=ndjson, the results are streamed instead, one JSON object per line.
+                The first line holds the 'id' and 'job_status' of the job.
+
+            (3) action == 'stop'
+                {
+                    'id':                   <the job id>,
+                    'stopped':              <True/ False, i.e. False if the job was already done or stopped>,
+                    'status':               <the status of the job after the request>
+                }
+
+        A stopped job finishes the batch of nodes it is working on and keeps its results so far.
     """
 
     methods = ['GET']
     valid_actions = ['results', 'status', 'stop']
     valid_args = ['id', 'action']
+    optional_args = ['cursor', 'limit', 'format']
+    valid_formats = ['json', 'ndjson']
+    max_limit = 10000
 
     def validate_input(self):
         """
@@ -199,13 +219,24 @@ class JobActionView(View):
 
         data = request.args.to_dict()
 
-        if len(data) != len(self.valid_args):
-            return False, "Invalid number of arguments: %d. Expected %d" % (len(data), len(self.valid_args))
-
         for arg in self.valid_args:
             if arg not in data:
                 return False, "Required argument: %s" % arg
 
+        for arg in data:
+            if arg not in self.valid_args + self.optional_args:
+                return False, "Invalid argument: %s" % arg
+
+        for arg in ['cursor', 'limit']:
+            if arg in data and not data[arg].isdigit():
+                return False, "Invalid %s: %s. Expected a non-negative integer" % (arg, data[arg])
+
+        if 'limit' in data and not 0 < int(data['limit']) <= self.max_limit:
+            return False, "Invalid limit: %s. Expected between 1 and %d" % (data['limit'], self.max_limit)
+
+        if data.get('format', 'json') not in self.valid_formats:
+            return False, "Invalid format: %s" % data['format']
+
         for action in self.valid_actions:
             if data['action'] == action:
                 return True, "Valid!"
@@ -241,8 +272,50 @@ class JobActionView(View):
 
             return jsonify(data)
 
+        elif action == 'stop':
+            stopped = utils.cacheHandler.stop_job(id)
+            status = utils.cacheHandler.get_job_status(id)
+
+            if status is None:
+                return Response(
+                    status=400,
+                    response='Invalid job id'
+                )
+
+            data = {
+                'id': id,
+                'stopped': stopped,
+                'status': status
+            }
+
+            return jsonify(data)
+
+        elif args.get('format', 'json') == 'ndjson':
+            status = utils.cacheHandler.get_job_status(id)
+
+            if status is None:
+                return Response(
+                    status=400,
+                    response='Invalid job id'
+                )
+
+            def generate():
+                yield json.dumps({'id': id, 'job_status': status}) + '\n'
+
+                for result in utils.cacheHandler.stream_nodes_for_job(id):
+                    yield json.dumps(result) + '\n'
+
+            return Response(
+                stream_with_context(generate()),
+                mimetype='application/x-ndjson'
+            )
+
         else:
-            data = utils.cacheHandler.get_nodes_for_job(id)
+            data = utils.cacheHandler.get_nodes_for_job(
+                id,
+                cursor=int(args['cursor']) if 'cursor' in args else None,
+                limit=int(args['limit']) if 'limit' in args else None
+            )
 
             if data is None:
                 return Response(
@@ -253,6 +326,105 @@ class JobActionView(View):
             return jsonify(data)
 
 
+class JobWaitView(View):
+    """
+        View that blocks until a job changes, i.e. until its status changes or new
+        results are cached, rather than having the clients poll its status.
+
+        Path: /job-wait?id=<jobID>[&status=<status>][&timeout=<seconds>]
+        Methods: GET
+
+        If the status given is not the current status of the job, or if the job is
+        already DONE or STOPPED, it returns right away. Otherwise it waits for at most
+        timeout seconds (default default_timeout, at most max_timeout).
+
+        If successful, it returns a JSON with the following format:
+                {
+                    'id':                   <the job id>,
+                    'status':               <the status of the job. One of: 'WAITING', 'RUNNING', 'DONE', 'STOPPED'>,
+                    'changed':              <True/ False, i.e. False if the timeout expired>
+                }
+    """
+    methods = ['GET']
+    valid_args = ['id']
+    optional_args = ['status', 'timeout']
+    default_timeout = 30
+    max_timeout = 60
+    final_status = ['DONE', 'STOPPED']
+
+    def validate_input(self):
+        """
+
+        :return:        True - if the input is valid
+                        False - otherwise
+        """
+        if request.method not in self.methods:
+            return False, "Invalid method: %s" % request.method
+
+        data = request.args.to_dict()
+
+        for arg in self.valid_args:
+            if arg not in data:
+                return False, "Required argument: %s" % arg
+
+        for arg in data:
+            if arg not in self.valid_args + self.optional_args:
+                return False, "Invalid argument: %s" % arg
+
+        if 'timeout' in data:
+            if not data['timeout'].isdigit() or int(data['timeout']) > self.max_timeout:
+                return False, "Invalid timeout: %s. Expected between 0 and %d" % (data['timeout'], self.max_timeout)
+
+        return True, "Valid!"
+
+    def dispatch_request(self):
+
+        sts, msg = self.validate_input()
+
+        if not sts:
+            return Response(
+                status=400,
+                response=msg
+            )
+
+        if utils.jobEvents is None:
+            return Response(
+                status=500,
+                response='Internal error'
+            )
+
+        args = request.args.to_dict()
+        id = args['id']
+        timeout = int(args.get('timeout', self.default_timeout))
+
+        # Taking the version first, so that no change is missed
+        # between reading the status and starting to wait
+        version = utils.jobEvents.version(id)
+        status = utils.cacheHandler.get_job_status(id)
+
+        if status is None:
+            return Response(
+                status=400,
+                response='Invalid job id'
+            )
+
+        changed = status != args.get('status', status)
+
+        if not changed and status not in self.final_status:
+            changed = utils.jobEvents.wait(id, version, timeout)
+
+            if changed:
+                status = utils.cacheHandler.get_job_status(id)
+
+        data = {
+            'id': id,
+            'status': status,
+            'changed': changed
+        }
+
+        return jsonify(data)
+
+
 class CacheResetView(View):
     """
         View class that handles requests that cause the cache database to be cleaned.
@@ -299,4 +471,7 @@ class CacheResetView(View):
 
         utils.cacheHandler.clear_cache()
 
+        if isinstance(utils.jobsHandler, JobsHandler):
+            utils.jobsHandler.clear_caches()
+
         return Response(200)
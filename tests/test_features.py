@@ -0,0 +1,84 @@
+"""
+Part2Project -- test_features.py
+
+Copyright May 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+pytest.importorskip('sklearn')
+pytest.importorskip('py2neo')
+pytest.importorskip('neo4j')
+
+import data.features
+from data.features import get_dataset
+
+# Feature vectors of the nodes that can be extracted, by (uuid, timestamp, )
+VECTORS = {
+    ('a', 1, ): {'F': 1.0},
+    ('b', 2, ): {'F': 2.0},
+    ('c', 3, ): {'F': 3.0},
+    ('d', 4, ): {'F': 4.0}
+}
+
+# One entry per edge, so a neighbour reached through two edges appears twice.
+# ('x', 0, ) can't be extracted.
+EDGES = {
+    ('a', 1, ): [('b', 2, ), ('c', 3, ), ('b', 2, ), ('c', 3, )],
+    ('b', 2, ): [('a', 1, ), ('c', 3, ), ('c', 3, ), ('d', 4, )],
+    ('d', 4, ): [('x', 0, ), ('x', 0, )]
+}
+
+
+class _FakeExtractor(object):
+    """
+        Stands in for the FeatureExtractor, over the VECTORS and EDGES graph
+    """
+    def __init__(self, nodes, driver, verbose=False, memo=None):
+        self.ids = [(node['uuid'], node['timestamp'], ) for node in nodes]
+
+    def get_feature_matrix(self, include_NONE=True, batch_size=None):
+        return [
+            {'id': id, 'self': VECTORS.get(id)}
+            for id in self.ids if include_NONE or id in VECTORS
+        ]
+
+    def get_neighbours(self, batch_size=None):
+        return [
+            {'id': id, 'neighs': [{'uuid': n[0], 'timestamp': n[1]} for n in EDGES[id]]}
+            for id in self.ids if id in EDGES
+        ]
+
+
+def test_gat_neighbours_keep_one_entry_per_edge(monkeypatch):
+    monkeypatch.setattr(data.features, 'FeatureExtractor', _FakeExtractor)
+
+    features = get_dataset(
+        driver=None,
+        nodes=[{'uuid': 'a', 'timestamp': 1}, {'uuid': 'b', 'timestamp': 2}, {'uuid': 'd', 'timestamp': 4}],
+        for_gat=True,
+        include_NONE=False
+    )
+
+    neighs = dict((node['id'], [n['F'] for n in node['neighs']], ) for node in features)
+
+    # Known neighbours once per edge, newly extracted ones once, after them
+    assert neighs[('a', 1, )] == [2.0, 2.0, 3.0]
+    # 'c' was extracted for 'a', so it is known by now
+    assert neighs[('b', 2, )] == [1.0, 3.0, 3.0, 4.0]
+    # A node whose new neighbours all failed to be extracted is its own neighbour
+    assert neighs[('d', 4, )] == [4.0]
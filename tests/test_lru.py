@@ -0,0 +1,94 @@
+"""
+Part2Project -- test_lru.py
+
+Copyright May 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+from decimal import Decimal
+
+import pytest
+
+from data.lru import LRUCache
+
+
+class _FakeDriver(object):
+    """
+        Stands in for the PostgresDriver, returning the rows PostgreSQL 14+
+        returns, whose extract(epoch ...) is a numeric, i.e. a Decimal
+    """
+    def __init__(self,
+                 rows: list):
+        self.rows = rows
+
+    def execute_VALUES(self, query, rows, template, cursor=None, fetch=False):
+        return self.rows
+
+
+def test_put_accepts_decimal_ttl():
+    lru = LRUCache(10)
+
+    lru.put('a', 1, Decimal('3600.5'))
+    lru.put('b', 2, Decimal('0'))
+
+    assert lru.get('a') == 1
+    assert lru.get('b') is None
+
+
+def test_cached_results_with_decimal_ttl_are_kept_in_memory():
+    pytest.importorskip('numpy')
+    pytest.importorskip('psycopg2')
+
+    from server.cache import CacheHandler
+
+    handler = object.__new__(CacheHandler)
+    handler.lru = LRUCache(10)
+    handler.postgresDriver = _FakeDriver([
+        ('uuid-1', 1, 0.9, 0.1, 'SHOW', 'pnn', Decimal('3599.999')),
+    ])
+
+    cached = handler.get_cached_results([{'uuid': 'uuid-1', 'timestamp': 1}])
+
+    assert cached[('uuid-1', 1, )]['recommended'] == 'SHOW'
+    assert handler.lru.get(('uuid-1', 1, ))['recommended'] == 'SHOW'
+
+
+def test_only_final_job_statuses_are_kept_in_memory():
+    pytest.importorskip('numpy')
+    pytest.importorskip('psycopg2')
+
+    from server.cache import CacheHandler
+
+    class StatusDriver(object):
+        def __init__(self):
+            self.status = 'RUNNING'
+            self.queries = 0
+
+        def execute_SELECT(self, query, *args):
+            self.queries += 1
+            return [(self.status, )]
+
+    handler = object.__new__(CacheHandler)
+    handler.statusLRU = LRUCache(10)
+    handler.postgresDriver = StatusDriver()
+
+    assert handler.get_job_status('job') == 'RUNNING'
+    assert handler.get_job_status('job') == 'RUNNING'
+    assert handler.postgresDriver.queries == 2
+
+    handler.postgresDriver.status = 'DONE'
+
+    assert handler.get_job_status('job') == 'DONE'
+    assert handler.get_job_status('job') == 'DONE'
+    assert handler.postgresDriver.queries == 3
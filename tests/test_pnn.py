@@ -0,0 +1,108 @@
+"""
+Part2Project -- test_pnn.py
+
+Copyright May 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('scipy')
+pytest.importorskip('pandas')
+
+from models.config import ModelConfig
+from models.pnn import ProbabilisticNeuralNetwork
+
+
+class ExactConfig(ModelConfig):
+    PNN_INDEX = None
+    PNN_CHUNK_SIZE = 16
+
+
+class IndexedConfig(ModelConfig):
+    PNN_INDEX = 'kdtree'
+    PNN_CHUNK_SIZE = 16
+
+
+def _get_model(config,
+               trainX: np.ndarray,
+               trainY: np.ndarray) -> ProbabilisticNeuralNetwork:
+    """
+
+    :param config:      The configuration of the model
+    :param trainX:      The stored training vectors
+    :param trainY:      The one-hot labels of the training vectors
+    :return:            A PNN holding the given training vectors
+    """
+    model = ProbabilisticNeuralNetwork(config)
+    model.weights = trainX
+    model.As = trainY
+    model._build_index()
+
+    return model
+
+
+def _get_training_set(rnd,
+                      size: int,
+                      dim: int):
+    """
+
+    :param rnd:         The random number generator
+    :param size:        The number of training vectors
+    :param dim:         The dimension of the training vectors
+    :return:            Random training vectors and their one-hot labels
+    """
+    trainX = rnd.normal(size=(size, dim))
+    trainY = np.zeros(shape=(size, 2))
+    trainY[np.arange(size), rnd.randint(2, size=size)] = 1
+
+    return trainX, trainY
+
+
+def test_kdtree_estimates_match_exact_kernel():
+    rnd = np.random.RandomState(0)
+    dim = ModelConfig.INPUT_DIM[0]
+
+    trainX, trainY = _get_training_set(rnd, 200, dim)
+
+    # Inputs close to the training vectors, and some far away from all
+    # of them, which fall back to the exact computation
+    X = np.concatenate([
+        trainX[:40] + rnd.normal(scale=.5, size=(40, dim)),
+        rnd.normal(size=(40, dim)),
+        rnd.normal(loc=100, size=(10, dim))
+    ])
+
+    exact = _get_model(ExactConfig, trainX, trainY)._get_parzen_estimates(X)
+    indexed = _get_model(IndexedConfig, trainX, trainY)._get_parzen_estimates(X)
+
+    # Every ignored kernel value is below the tolerance
+    atol = len(trainX) * IndexedConfig.PNN_KERNEL_TOLERANCE
+
+    assert indexed.shape == exact.shape
+    assert np.allclose(indexed, exact, rtol=0, atol=atol)
+
+
+def test_kdtree_handles_identical_vectors():
+    rnd = np.random.RandomState(1)
+    dim = ModelConfig.INPUT_DIM[0]
+
+    trainX, trainY = _get_training_set(rnd, 50, dim)
+
+    # Zero distances must still be counted
+    exact = _get_model(ExactConfig, trainX, trainY)._get_parzen_estimates(trainX)
+    indexed = _get_model(IndexedConfig, trainX, trainY)._get_parzen_estimates(trainX)
+
+    assert np.allclose(indexed, exact, rtol=0, atol=len(trainX) * IndexedConfig.PNN_KERNEL_TOLERANCE)
@@ -0,0 +1,128 @@
+"""
+Part2Project -- test_utils.py
+
+Copyright May 2018 [Tudor Mihai Avram]
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+import random
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pd = pytest.importorskip('pandas')
+pytest.importorskip('sklearn')
+
+from data.utils import process_list
+
+FEATURES = ['F%d' % idx for idx in range(5)]
+LABELS = ['SHOW', 'HIDE']
+
+
+def _append_dict_to_df(new_data: dict,
+                       df: pd.DataFrame) -> pd.DataFrame:
+    """
+
+    :param new_data:        The dictionary to append
+    :param df:              The dataframe to append to
+    :return:                The resulting dataframe
+    """
+    return pd.concat([df, pd.DataFrame(new_data, index=[0])], axis=0, ignore_index=True)
+
+
+def _process_list_by_append(data: list,
+                            labels: list,
+                            features: list) -> tuple:
+    """
+            The previous implementation, growing a DataFrame one node at a time
+
+    :param data:            The input list of nodes, with their features
+    :param labels:          The label names
+    :param features:        The feature names
+    :return:                The (X, N, Y) arrays
+    """
+    X_df = pd.DataFrame(columns=features)
+    Y_df = pd.DataFrame(columns=labels)
+
+    N = np.zeros(
+        shape=(len(data), 20, len(features))
+    )
+
+    for idx in range(len(data)):
+        node = data[idx]
+        X_df = _append_dict_to_df(new_data=node['self'], df=X_df)
+
+        neighs_df = pd.DataFrame(columns=features)
+
+        for neigh in node['neighs'][:20]:
+            neighs_df = _append_dict_to_df(new_data=neigh, df=neighs_df)
+
+        N[idx, :len(neighs_df), :] = neighs_df[features].values
+
+        Y_df = _append_dict_to_df(
+            new_data={
+                'SHOW': node['SHOW'],
+                'HIDE': node['HIDE']
+            },
+            df=Y_df
+        )
+
+    return X_df[features].values.astype(float), N, Y_df[labels].values.astype(float)
+
+
+def _get_random_nodes(count: int) -> list:
+    """
+
+    :param count:           The number of nodes
+    :return:                Random nodes, in the format for GAT, with up to 25 neighbours
+    """
+    rnd = random.Random(0)
+
+    def vector():
+        return dict((feature, rnd.random()) for feature in FEATURES)
+
+    nodes = list()
+
+    for _ in range(count):
+        show = rnd.randint(0, 1)
+
+        nodes.append({
+            'self': vector(),
+            'neighs': [vector() for _ in range(rnd.randint(1, 25))],
+            'SHOW': show,
+            'HIDE': 1 - show
+        })
+
+    return nodes
+
+
+def test_process_list_matches_previous_implementation():
+    data = _get_random_nodes(30)
+
+    X, N, Y = process_list(data, LABELS, FEATURES)
+    X_old, N_old, Y_old = _process_list_by_append(data, LABELS, FEATURES)
+
+    assert X.dtype == N.dtype == Y.dtype == np.float64
+    np.testing.assert_array_equal(X, X_old)
+    np.testing.assert_array_equal(N, N_old)
+    np.testing.assert_array_equal(Y, Y_old)
+
+
+def test_process_list_dtype():
+    data = _get_random_nodes(5)
+
+    X, N, Y = process_list(data, LABELS, FEATURES, dtype=np.float32)
+
+    assert X.dtype == N.dtype == Y.dtype == np.float32
+    np.testing.assert_allclose(X, _process_list_by_append(data, LABELS, FEATURES)[0], rtol=1e-6)